@@ -1,3 +1,4 @@
+import copy
 from collections import defaultdict
 from typing import Dict, List
 
@@ -120,7 +121,8 @@ class DreamNight(Data):
         return suggestions
 
     def enriched_data(self, form_data) -> DailysData:
-        raw_data = self.raw_data["data"]
+        # Copied, as the entry may be shared with the data source's cache
+        raw_data = copy.deepcopy(self.raw_data["data"])
         for dream_idx in range(len(self.dreams)):
             if f"disorientation-{dream_idx}" in form_data:
                 disorientation = int(form_data[f"disorientation-{dream_idx}"])
@@ -144,7 +146,7 @@ class DreamNight(Data):
 
     def enrichment_form(self, data_source):
         # Get lists of tags and stuff
-        all_entries = data_source.get_entries_for_stat_over_range("dreams", "earliest", "latest")
+        all_entries = data_source.iter_entries_for_stat_over_range("dreams", "earliest", "latest")
         tags = set()
         known_people = set()
         famous_people = set()
@@ -0,0 +1,39 @@
+from typing import Iterable, List
+
+from dailys_models.model_dict import MODEL_DICT
+from dailys_web.data_source.data_source import DailysEntry, ValueCount
+
+# Calculations for stats -> values, for stats which don't have a model
+VALUE_CALC = {
+    "mood": lambda x: len(x.keys()) * len([y for y in x[list(x)[0]].keys() if y != "message_id"]),
+    "duolingo": lambda x: len(x.keys()),
+    "chores": lambda x: len(x['chores_done'])
+}
+
+
+def value_count_for_entry(entry: DailysEntry) -> int:
+    stat_name = entry["stat_name"]
+    # Create data object, if applicable
+    if MODEL_DICT.get(stat_name) is not None:
+        return MODEL_DICT[stat_name](entry).value_count()
+    return VALUE_CALC.get(stat_name, lambda x: 0)(entry["data"])
+
+
+def stored_value_count(entry: DailysEntry) -> int:
+    # Malformed entries are stored as having no values, rather than blocking the write
+    try:
+        return value_count_for_entry(entry)
+    except (KeyError, TypeError, ValueError, AttributeError, IndexError):
+        return 0
+
+
+def count_values(entries: Iterable[DailysEntry]) -> List[ValueCount]:
+    totals = {}
+    for entry in entries:
+        key = (entry["date"].date(), entry["stat_name"], entry["source"])
+        entries_count, values_count = totals.get(key, (0, 0))
+        totals[key] = (entries_count + 1, values_count + stored_value_count(entry))
+    return [
+        ValueCount(stat_name, stat_date, source, entries_count, values_count)
+        for (stat_date, stat_name, source), (entries_count, values_count) in sorted(totals.items())
+    ]
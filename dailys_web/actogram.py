@@ -0,0 +1,107 @@
+import datetime
+from io import BytesIO
+from typing import List, Tuple
+
+import dateutil.parser
+import numpy
+from PIL import Image
+
+from dailys_models.sleep_data import FullSleepData
+
+# Bump this whenever Actogram draws differently, so that clients don't keep actograms drawn by older code
+RENDER_VERSION = 2
+
+
+def parse_time(value: str) -> datetime.datetime:
+    # Parsing every time of a year of nights adds up, so try the much faster ISO parser first
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
+
+class Actogram:
+    """
+    Renders many nights of sleep into one image, with a row per night and a column per few minutes. As with
+    SleepDiaryImage, each night's row starts at start_hour on that night's date. Double plotted actograms show each
+    night followed by the next, so that sleep drifting past the end of a row can still be followed.
+    Every night is rasterized together into one array, rather than drawn period by period.
+    """
+    MINUTES_PER_DAY = 24 * 60
+
+    def __init__(
+            self,
+            start_hour: int = 18,
+            double_plotted: bool = False,
+            minutes_per_pixel: int = 3,
+            row_height: int = 4
+    ) -> None:
+        if self.MINUTES_PER_DAY % minutes_per_pixel != 0:
+            raise ValueError("minutes_per_pixel must divide evenly into a day")
+        self.start_hour = start_hour
+        self.double_plotted = double_plotted
+        self.minutes_per_pixel = minutes_per_pixel
+        self.row_height = row_height
+
+    @staticmethod
+    def sleep_periods(sleep: FullSleepData) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        """Splits a night into the periods spent asleep, between any interruptions"""
+        data = sleep.raw_data["data"]
+        periods = []
+        start_time = parse_time(data["sleep_time"])
+        for interruption in sleep.interruptions or []:
+            if "wake_time" in interruption and "sleep_time" in interruption:
+                periods.append((start_time, parse_time(interruption["wake_time"])))
+                start_time = parse_time(interruption["sleep_time"])
+        periods.append((start_time, parse_time(data["wake_time"])))
+        return periods
+
+    def asleep_minutes(self, sleeps: List[FullSleepData]) -> numpy.ndarray:
+        """
+        Builds a boolean array of nights by minutes, of whether each minute was spent asleep.
+        Rows run from the earliest night to the latest, including empty rows for nights without data.
+        """
+        first_date = min(sleep.date.date() for sleep in sleeps)
+        last_date = max(sleep.date.date() for sleep in sleeps)
+        nights = (last_date - first_date).days + 1
+        total_minutes = nights * self.MINUTES_PER_DAY
+        # Offsets of each period's start and end, in minutes along one timeline running through every row in turn.
+        # Periods are placed by their own time zones, as in SleepDiaryImage.
+        starts = []
+        ends = []
+        for sleep in sleeps:
+            for start_time, end_time in self.sleep_periods(sleep):
+                timeline_start = datetime.datetime.combine(
+                    first_date, datetime.time(self.start_hour), tzinfo=start_time.tzinfo
+                )
+                starts.append((start_time - timeline_start).total_seconds() // 60)
+                ends.append((end_time - timeline_start).total_seconds() // 60)
+        starts = numpy.clip(numpy.array(starts, dtype=numpy.int64), 0, total_minutes)
+        ends = numpy.clip(numpy.array(ends, dtype=numpy.int64), 0, total_minutes)
+        # Periods ending before they start, such as from a mistyped date, would cancel out other nights' sleep
+        valid = ends > starts
+        starts = starts[valid]
+        ends = ends[valid]
+        # Mark where periods start and end, then a running total is positive wherever a period is underway
+        changes = numpy.zeros(total_minutes + 1, dtype=numpy.int32)
+        numpy.add.at(changes, starts, 1)
+        numpy.add.at(changes, ends, -1)
+        asleep = numpy.cumsum(changes[:-1]) > 0
+        return asleep.reshape(nights, self.MINUTES_PER_DAY)
+
+    def render(self, sleeps: List[FullSleepData]) -> Image.Image:
+        asleep = self.asleep_minutes(sleeps)
+        if self.double_plotted:
+            following = numpy.vstack([asleep[1:], numpy.zeros((1, self.MINUTES_PER_DAY), dtype=bool)])
+            asleep = numpy.hstack([asleep, following])
+        # Shade each pixel by the fraction of its minutes spent asleep
+        rows, minutes = asleep.shape
+        shade = asleep.reshape(rows, minutes // self.minutes_per_pixel, self.minutes_per_pixel).mean(axis=2)
+        pixels = (255 - shade * 255).astype(numpy.uint8)
+        pixels = numpy.repeat(pixels, self.row_height, axis=0)
+        return Image.fromarray(pixels)
+
+    def to_png(self, sleeps: List[FullSleepData]) -> bytes:
+        buffered = BytesIO()
+        self.render(sleeps).save(buffered, format="PNG")
+        return buffered.getvalue()
@@ -1,3 +1,4 @@
+import copy
 import json
 from typing import Dict
 
@@ -69,7 +70,7 @@ class FormsBlueprint(BaseBlueprint):
         if len(current_data) == 0:
             new_data = dict()
         else:
-            new_data = current_data[0]['data']
+            new_data = copy.deepcopy(current_data[0]['data'])
         if "chores_done" not in new_data:
             new_data['chores_done'] = []
         if chore in new_data['chores_done']:
@@ -1,12 +1,32 @@
-from datetime import datetime
-from typing import Union
+import json
+import logging
+import re
+from datetime import datetime, date
+from typing import Union, List, Any, Optional, Tuple, Iterator
 
 import flask
 from flask import request, abort
+from werkzeug.routing import ValidationError
 
-from dailys_web.data_source.data_source import DataSource, CantUpdate
+from dailys_web.conditional import stat_conditional
+from dailys_web.data_source.data_source import DataSource, CantUpdate, DailysEntry, DailysDate, BulkProgress
 from dailys_web.decorators import edit_auth_required, view_auth_required
 from dailys_web.blueprints.base_blueprint import BaseBlueprint
+from dailys_web.path_converters import SpecifiedDayConverter
+from dailys_web.streaming import stream_entries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+
+class BulkRecordError(Exception):
+    pass
+
+
+class PageRequestError(Exception):
+    pass
 
 
 class StatsBlueprint(BaseBlueprint):
@@ -16,6 +36,8 @@ class StatsBlueprint(BaseBlueprint):
 
     def register(self):
         self.blueprint.route("/")(self.list_stats)
+        self.blueprint.route("/_bulk", methods=['POST'])(self.bulk_update_stat_data)
+        self.blueprint.route("/_changes")(self.list_changes)
         self.blueprint.route("/<stat_name>/")(self.stat_data)
         self.blueprint.route("/<stat_name>/<view_date:view_date>/", methods=['GET'])(self.stat_data_on_date)
         self.blueprint.route("/<stat_name>/<view_date:view_date>/", methods=['PUT'])(self.update_stat_data_on_date)
@@ -23,17 +45,90 @@ class StatsBlueprint(BaseBlueprint):
         # self.remove_stat_data_on_date)
         self.blueprint.route("/<stat_name>/<start_date:start_date>/<end_date:end_date>")(self.stat_data_with_date_range)
 
+    @staticmethod
+    def _requested_fields() -> Optional[List[str]]:
+        """Reads the comma separated ?fields= query argument, of dotted paths into entries' data"""
+        fields = request.args.get("fields")
+        if fields is None:
+            return None
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+        # SQLite's JSON paths can't quote keys containing double quotes, so they'd match nothing there
+        if any('"' in field for field in fields):
+            abort(flask.make_response(flask.jsonify({"error": "fields can't contain double quotes"}), 400))
+        # An empty ?fields= asks for no particular fields, so gives all of them
+        return fields or None
+
+    @staticmethod
+    def _is_page_request() -> bool:
+        return "limit" in request.args or "after" in request.args
+
+    @staticmethod
+    def _requested_page() -> Tuple[int, Optional[date]]:
+        """Reads the ?limit= page size and ?after= date cursor query arguments"""
+        limit = DEFAULT_PAGE_SIZE
+        if "limit" in request.args:
+            try:
+                limit = int(request.args["limit"])
+            except ValueError:
+                raise PageRequestError("limit must be an integer")
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise PageRequestError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        after = None
+        if "after" in request.args:
+            try:
+                after = datetime.strptime(request.args["after"], "%Y-%m-%d").date()
+            except ValueError:
+                raise PageRequestError("after must be a date, in YYYY-MM-DD format")
+            # No date comes after the last one, so there's no range to page through
+            if after == date.max:
+                raise PageRequestError(f"after must be before {date.max.isoformat()}")
+        return limit, after
+
+    def _stat_data_page(
+            self,
+            stat_name: str,
+            start_date: DailysDate,
+            end_date: DailysDate,
+            include_static: bool = False
+    ):
+        """
+        Responds with one page of a stat's entries, and the cursor to request the next page with, as ?after=.
+        When including the static entry, it comes last, on the last page, as in the unpaged response.
+        """
+        try:
+            limit, after = self._requested_page()
+        except PageRequestError as e:
+            return flask.jsonify({"error": str(e)}), 400
+        fields = self._requested_fields()
+        page = self.data_source.get_page_for_stat_over_range(stat_name, start_date, end_date, limit, after, fields)
+        entries = page.entries
+        if include_static and page.next_after is None:
+            entries += self.data_source.get_entries_for_stat_on_date(stat_name, "static", fields)
+        return flask.jsonify({
+            "entries": entries,
+            "next": None if page.next_after is None else page.next_after.isoformat()
+        })
+
     @view_auth_required
     def list_stats(self):
         return flask.jsonify(list(self.data_source.get_unique_stat_names()))
 
     @view_auth_required
+    @stat_conditional
     def stat_data(self, stat_name: str):
-        return flask.jsonify(self.data_source.get_entries_for_stat(stat_name))
+        if self._is_page_request():
+            return self._stat_data_page(stat_name, "earliest", "latest", include_static=True)
+        fields = self._requested_fields()
+
+        def stat_entries() -> Iterator[DailysEntry]:
+            yield from self.data_source.iter_entries_for_stat_over_range(stat_name, "earliest", "latest", fields)
+            yield from self.data_source.get_entries_for_stat_on_date(stat_name, "static", fields)
+        return stream_entries(stat_entries())
 
     @view_auth_required
+    @stat_conditional
     def stat_data_on_date(self, stat_name: str, view_date: Union[datetime, str]):
-        data = self.data_source.get_entries_for_stat_on_date(stat_name, view_date)
+        data = self.data_source.get_entries_for_stat_on_date(stat_name, view_date, self._requested_fields())
         return flask.jsonify(data)
 
     @edit_auth_required
@@ -51,8 +146,145 @@ class StatsBlueprint(BaseBlueprint):
             abort(404)
 
     @view_auth_required
+    def list_changes(self):
+        """
+        Lists entries written or removed since the ?since= position in the change feed, up to ?limit= of them.
+        Removed entries are listed with deleted set, and no entry. Clients pass the returned next position as since,
+        to fetch the following changes.
+        """
+        try:
+            since = int(request.args.get("since", 0))
+            limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return flask.jsonify({"error": "since and limit must be integers"}), 400
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return flask.jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+        # Fetch one extra change, to tell whether there are more
+        changes = self.data_source.get_changes_since(since, limit + 1)
+        return flask.jsonify({
+            "changes": [
+                {
+                    "seq": change.seq,
+                    "stat_name": change.stat_name,
+                    "date": "static" if change.date == "static" else change.date.date().isoformat(),
+                    "deleted": change.entry is None,
+                    "entry": change.entry
+                }
+                for change in changes[:limit]
+            ],
+            "next": changes[:limit][-1].seq if changes else since,
+            "more": len(changes) > limit
+        })
+
+    @edit_auth_required
+    def bulk_update_stat_data(self):
+        """
+        Accepts a JSON array, or newline delimited JSON, of {stat_name, date, source, data} records.
+        Valid records are all written in one transaction, and a status is returned for each record.
+        Firestore commits a few hundred writes at a time, so there, a failure can leave earlier records written. Records
+        are only reported as ok once they're committed, and the rest as errors, so the client knows which to resend.
+        """
+        try:
+            raw_records = self._read_bulk_records()
+        except BulkRecordError as e:
+            return flask.jsonify({"error": str(e)}), 400
+        default_source = request.args.get("source") or "Unknown [via API]"
+        converter = SpecifiedDayConverter(flask.current_app.url_map)
+        results = []
+        entries = []
+        # Results of the valid records, in the order they're written
+        entry_results = []
+        for index, raw_record in enumerate(raw_records):
+            try:
+                entry = self._parse_bulk_record(raw_record, converter, default_source)
+            except BulkRecordError as e:
+                results.append({"index": index, "status": "error", "error": str(e)})
+                continue
+            entries.append(entry)
+            result = {"index": index, "stat_name": entry["stat_name"], "date": raw_record["date"]}
+            results.append(result)
+            entry_results.append(result)
+        committed = 0
+
+        def on_batch(batch_progress: BulkProgress) -> None:
+            nonlocal committed
+            committed = batch_progress.total_entries
+
+        error = None
+        if entries:
+            try:
+                self.data_source.update_entries_bulk(entries, batch_size=len(entries), progress=on_batch)
+            except Exception:
+                logger.exception("Bulk update failed after %s of %s records", committed, len(entries))
+                error = "Not written, as the write failed"
+        written = committed if error is not None else len(entries)
+        for result in entry_results[:written]:
+            result["status"] = "ok"
+        for result in entry_results[written:]:
+            result.update({"status": "error", "error": error})
+        response = flask.jsonify({"written": written, "results": results})
+        return (response, 500) if error is not None else response
+
+    def _read_bulk_records(self) -> List[Any]:
+        if request.mimetype == "application/x-ndjson":
+            records = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    # Keep the line's place, so that statuses line up with the records sent
+                    records.append(BulkRecordError(f"Invalid JSON: {e}"))
+            return records
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            raise BulkRecordError("Request body must be a JSON array, or newline delimited JSON")
+        return records
+
+    def _parse_bulk_record(
+            self,
+            raw_record: Any,
+            converter: SpecifiedDayConverter,
+            default_source: str
+    ) -> DailysEntry:
+        if isinstance(raw_record, BulkRecordError):
+            raise raw_record
+        if not isinstance(raw_record, dict):
+            raise BulkRecordError("Record must be a JSON object")
+        for key in ["stat_name", "date", "data"]:
+            if key not in raw_record:
+                raise BulkRecordError(f"Record is missing {key}")
+        stat_name = raw_record["stat_name"]
+        if not isinstance(stat_name, str) or not stat_name:
+            raise BulkRecordError("stat_name must be a non-empty string")
+        return {
+            "stat_name": stat_name,
+            "date": self._parse_bulk_date(raw_record["date"], converter),
+            "source": raw_record.get("source") or default_source,
+            "data": raw_record["data"]
+        }
+
+    def _parse_bulk_date(self, raw_date: Any, converter: SpecifiedDayConverter) -> DailysDate:
+        # Validate the same way as the <view_date:view_date> path segment of the single entry endpoint
+        if not isinstance(raw_date, str) or not re.fullmatch(converter.regex, raw_date):
+            raise BulkRecordError(f"Invalid date: {raw_date}")
+        try:
+            entry_date = converter.to_python(raw_date)
+        except ValidationError:
+            raise BulkRecordError(f"Invalid date: {raw_date}")
+        if entry_date in ["earliest", "latest"]:
+            raise BulkRecordError("Can't update data on earliest/latest")
+        return entry_date
+
+    @view_auth_required
+    @stat_conditional
     def stat_data_with_date_range(self, stat_name, start_date, end_date):
-        return flask.jsonify(self.data_source.get_entries_for_stat_over_range(stat_name, start_date, end_date))
+        if self._is_page_request():
+            return self._stat_data_page(stat_name, start_date, end_date)
+        return stream_entries(self.data_source.iter_entries_for_stat_over_range(
+            stat_name, start_date, end_date, self._requested_fields()
+        ))
 
     @edit_auth_required
     def remove_stat_data_on_date(self, stat_name, view_date):
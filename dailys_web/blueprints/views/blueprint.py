@@ -14,11 +14,13 @@ from dailys_web.blueprints.views.named_dates import NamedDatesView
 from dailys_web.blueprints.views.question_each import IndividualQuestionRangeView, IndividualQuestionView
 from dailys_web.blueprints.views.questions import QuestionsRangeView, QuestionsView
 from dailys_web.blueprints.views.sleep_status import SleepStatusJsonView, SleepStatusView
-from dailys_web.blueprints.views.sleep_time import SleepTimeRangeView, SleepTimeView
+from dailys_web.blueprints.views.sleep_time import SleepTimeRangeView, SleepTimeView, SleepDiaryImageView, \
+    SleepDiarySvgView, SleepActogramRangeView, SleepActogramView
 from dailys_web.blueprints.views.stats import StatsRangeView, StatsView
 from dailys_web.data_source.data_source import DataSource
 from dailys_web.decorators import view_auth_required
 from dailys_web.blueprints.base_blueprint import BaseBlueprint
+from dailys_web.sleep_diary_cache import SleepDiaryImageCache
 
 
 class ViewsBlueprint(BaseBlueprint):
@@ -26,11 +28,18 @@ class ViewsBlueprint(BaseBlueprint):
     def __init__(self, data_source: DataSource, config: Dict[str, str]):
         super().__init__(data_source, "views")
         self.config = config
+        # Shared by the sleep views, as views are recreated whenever they're listed
+        self.sleep_images = SleepDiaryImageCache.from_config(config.get("sleep_diary_cache", {}))
 
     def _list_views(self):
         return [
-            SleepTimeRangeView(self.data_source, self.config),
-            SleepTimeView(self.data_source, self.config),
+            SleepTimeRangeView(self.data_source, self.config, self.sleep_images),
+            SleepTimeView(self.data_source, self.config, self.sleep_images),
+            SleepDiaryImageView(self.data_source, self.sleep_images),
+            SleepDiarySvgView(self.data_source, self.sleep_images),
+            # Rows start at the same hour as the sleep diary images
+            SleepActogramRangeView(self.data_source, self.sleep_images.start_hour),
+            SleepActogramView(self.data_source, self.sleep_images.start_hour),
             FANotificationsRangeView(self.data_source),
             FANotificationsView(self.data_source),
             MoodRangeView(self.data_source),
@@ -16,7 +16,7 @@ class ChoresBoardJsonView(View):
     def call(self, **kwargs):
         today = date.today()
         chores_static = self.data_source.get_entries_for_stat_on_date("chores", "static")[0]
-        chores_data = self.data_source.get_entries_for_stat_over_range("chores", "earliest", "latest")
+        chores_data = self.data_source.iter_entries_for_stat_over_range("chores", "earliest", "latest")
         chores = [Chore(x) for x in chores_static['data']['chores']]
         for chore_date in chores_data:
             for chore in chores:
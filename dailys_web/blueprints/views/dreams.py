@@ -73,13 +73,16 @@ class DreamsRangeView(View):
         )
 
     def get_dream_nights(self, start_date, end_date):
-        dreams_data = self.data_source.get_entries_for_stat_over_range("dreams", start_date, end_date)
-        dream_nights = [DreamNight(x) for x in dreams_data]
-        static_data = self.data_source.get_entries_for_stat_on_date("dreams", "static")
+        stats_entries = self.data_source.get_entries_for_stats_over_range(
+            {"dreams": (start_date, end_date)},
+            include_static=["dreams"]
+        )
+        dream_nights = [DreamNight(x) for x in stats_entries.entries["dreams"]]
+        static_data = stats_entries.static.get("dreams")
         # Fill in missing dates
-        if static_data and "all_nights_start" in static_data[0]["data"]:
+        if static_data and "all_nights_start" in static_data["data"]:
             dream_dates = [night.date.date() for night in dream_nights]
-            start_date = dateutil.parser.parse(static_data[0]["data"]["all_nights_start"]).date()
+            start_date = dateutil.parser.parse(static_data["data"]["all_nights_start"]).date()
             end_date = max(dream_dates)
             current_date = max(start_date, min(dream_dates))
             while current_date <= end_date:
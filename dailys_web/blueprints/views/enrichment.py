@@ -21,7 +21,7 @@ class EnrichmentView(View):
         return "/enrichment/"
 
     def call(self, **kwargs):
-        all_data = self.data_source.get_entries_over_range("earliest", "latest")
+        all_data = self.data_source.iter_entries_over_range("earliest", "latest")
         # Get list of all suggestions
         suggestions = []
         for entry in all_data:
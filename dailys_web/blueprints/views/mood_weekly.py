@@ -17,20 +17,23 @@ class MoodWeeklyRangeView(View):
     def call(self, **kwargs):
         start_date = kwargs["start_date"]
         end_date = kwargs["end_date"]
-        # Get static mood data
-        mood_static = self.data_source.get_entries_for_stat_on_date("mood", "static")[0]['data']
-        # Get mood data
-        mood_data = self.data_source.get_entries_for_stat_over_range("mood", start_date, end_date)
-        # Get sleep data, if necessary
+        sleep_start_date = start_date
+        if start_date != "earliest":
+            sleep_start_date -= timedelta(days=1)
+        sleep_end_date = end_date
+        if end_date != "latest":
+            sleep_end_date -= timedelta(days=1)
+        # Get static mood data, mood data, and sleep data all at once, though sleep data is only sometimes needed
+        stats_entries = self.data_source.get_entries_for_stats_over_range(
+            {"mood": (start_date, end_date), "sleep": (sleep_start_date, sleep_end_date)},
+            include_static=["mood"]
+        )
+        mood_static = stats_entries.static["mood"]['data']
+        mood_data = stats_entries.entries["mood"]
+        # Parse sleep data, if necessary
         sleep_data = {}
         if "WakeUpTime" in mood_static['times'] or "SleepTime" in mood_static['times']:
-            sleep_start_date = start_date
-            if start_date != "earliest":
-                sleep_start_date -= timedelta(days=1)
-            sleep_end_date = end_date
-            if end_date != "latest":
-                sleep_end_date -= timedelta(days=1)
-            sleep_data_response = self.data_source.get_entries_for_stat_over_range("sleep", sleep_start_date, sleep_end_date)
+            sleep_data_response = stats_entries.entries["sleep"]
             try:
                 sleep_data = {FullSleepData(x).date: FullSleepData(x) for x in sleep_data_response}
             except KeyError as e:
@@ -13,12 +13,15 @@ class IndividualQuestionRangeView(View):
         question_id = kwargs["question_id"]
         start_date = kwargs["start_date"]
         end_date = kwargs["end_date"]
-        # Get question data
-        q_static = self.data_source.get_entries_for_stat_on_date("questions", "static")[0]['data']
+        # Get question data and answers data
+        stats_entries = self.data_source.get_entries_for_stats_over_range(
+            {"questions": (start_date, end_date)},
+            include_static=["questions"]
+        )
+        q_static = stats_entries.static["questions"]['data']
         questions = [StaticQuestion(data) for data in q_static["questions"]]
         question = next((question for question in questions if question.id == question_id), None)
-        # Get answers data
-        answers_data = self.data_source.get_entries_for_stat_over_range("questions", start_date, end_date)
+        answers_data = stats_entries.entries["questions"]
         answers_days = [QuestionsDay(data) for data in answers_data]
         answers_days = [answers for answers in answers_days if question_id in answers.answers]
         # Get stats object
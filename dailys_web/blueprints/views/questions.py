@@ -40,11 +40,14 @@ class QuestionsRangeView(View):
     def call(self, **kwargs):
         start_date = kwargs["start_date"]
         end_date = kwargs["end_date"]
-        # Get question data
-        q_static = self.data_source.get_entries_for_stat_on_date("questions", "static")[0]['data']
+        # Get question data and answers data
+        stats_entries = self.data_source.get_entries_for_stats_over_range(
+            {"questions": (start_date, end_date)},
+            include_static=["questions"]
+        )
+        q_static = stats_entries.static["questions"]['data']
         questions = [StaticQuestion(data) for data in q_static["questions"]]
-        # Get answers data
-        answers_data = self.data_source.get_entries_for_stat_over_range("questions", start_date, end_date)
+        answers_data = stats_entries.entries["questions"]
         answers_days = [QuestionsDay(data) for data in answers_data]
         # Get stats object
         stats = QuestionStats(questions, answers_days)
@@ -1,21 +1,32 @@
 import datetime
 
 import flask
+from flask import request
+from markupsafe import Markup
 import numpy
 import pytz
+from werkzeug.http import is_resource_modified
 
 from dailys_models.sleep_data import FullSleepData, CurrentlySleeping
+from dailys_web.actogram import Actogram, RENDER_VERSION as ACTOGRAM_RENDER_VERSION
 from dailys_web.blueprints.views.base_view import View
 from dailys_web.colour_scale import ColourScale, MidPointColourScale
+from dailys_web.conditional import version_etag
 from dailys_web.nav_data import NavData
-from dailys_web.sleep_diary_image import SleepDiaryImage
+from dailys_web.sleep_diary_cache import SleepDiaryImageCache, RENDERED_FIELDS, IMAGE_FORMATS
+
+# Length of the content hash in image URLs, which only needs to change when a night is edited
+IMAGE_VERSION_LENGTH = 16
+# Endpoints of the views serving sleep diary images in each format, as named by ViewsBlueprint
+IMAGE_ENDPOINTS = {"png": ".SleepDiaryImageView_call", "svg": ".SleepDiarySvgView_call"}
 
 
 class SleepTimeRangeView(View):
 
-    def __init__(self, data_source, config):
+    def __init__(self, data_source, config, image_cache: SleepDiaryImageCache):
         super().__init__(data_source)
         self.config = config
+        self.image_cache = image_cache
 
     def get_path(self):
         return "/sleep_time/<start_date:start_date>/<end_date:end_date>/"
@@ -23,8 +34,10 @@ class SleepTimeRangeView(View):
     def call(self, **kwargs):
         start_date = kwargs["start_date"]
         end_date = kwargs["end_date"]
-        # Get data
-        sleep_data_response = self.data_source.get_entries_for_stat_over_range("sleep", start_date, end_date)
+        # Get data, only the fields used here, as sleep entries can hold a lot more
+        sleep_data_response = self.data_source.get_entries_for_stat_over_range(
+            "sleep", start_date, end_date, fields=RENDERED_FIELDS
+        )
         try:
             sleep_data = [FullSleepData(x) for x in sleep_data_response]
         except KeyError as e:
@@ -81,12 +94,20 @@ class SleepTimeRangeView(View):
             max([x['avg'] for x in weekly_stats.values() if x['avg'] is not None]),
             ColourScale.YELLOW, ColourScale.WHITE, ColourScale.GREEN
         )
-        # Generate images
+        # Images are either inlined as SVG, or linked by their content hash, so browsers can cache them until the
+        # night is edited
+        image_mode = request.args.get("images", self.config.get("sleep_diary_images", "png"))
         images = dict()
         for sleep in sleep_data:
-            image = SleepDiaryImage()
-            image.add_sleep_data(sleep)
-            images[sleep.date] = image.to_base64_encoded()
+            if image_mode == "inline":
+                images[sleep.date] = Markup(self.image_cache.get_svg(sleep))
+                continue
+            image_format = "svg" if image_mode == "svg" else "png"
+            images[sleep.date] = flask.url_for(
+                IMAGE_ENDPOINTS[image_format],
+                image_date=sleep.date,
+                v=self.image_cache.image_key(sleep, image_format)[:IMAGE_VERSION_LENGTH]
+            )
         # Return page
         return flask.render_template(
             "sleep_time.html",
@@ -97,6 +118,8 @@ class SleepTimeRangeView(View):
             stats_scale=stats_scale,
             weekly_scale=weekly_scale,
             sleep_images=images,
+            sleep_images_inline=image_mode == "inline",
+            sleep_image_size=self.image_cache.image_size,
             timezone=now_zone,
             a_day=datetime.timedelta(days=1),
             week_by_week=week_by_week,
@@ -154,3 +177,103 @@ class SleepTimeView(SleepTimeRangeView):
 
     def call(self, **kwargs):
         return super().call(start_date="earliest", end_date="latest")
+
+
+class SleepDiaryImageView(View):
+    """
+    Serves the sleep diary image of one night. Pages link to it with the image's content hash as ?v=, and those URLs
+    never change content, so browsers can keep them. Requests without the current hash must revalidate the ETag.
+    """
+    image_format = "png"
+
+    def __init__(self, data_source, image_cache: SleepDiaryImageCache):
+        super().__init__(data_source)
+        self.image_cache = image_cache
+
+    def get_path(self):
+        return f"/sleep_time/image/<date:image_date>.{self.image_format}"
+
+    def call(self, **kwargs):
+        image_date = kwargs["image_date"]
+        entries = self.data_source.get_entries_for_stat_on_date("sleep", image_date, fields=RENDERED_FIELDS)
+        if not entries:
+            flask.abort(404)
+        try:
+            sleep = FullSleepData(entries[0])
+        except (KeyError, CurrentlySleeping):
+            flask.abort(404)
+        image_key = self.image_cache.image_key(sleep, self.image_format)
+        if is_resource_modified(request.environ, etag=image_key):
+            response = flask.Response(
+                self.image_cache.get_image(sleep, self.image_format),
+                mimetype=IMAGE_FORMATS[self.image_format]
+            )
+        else:
+            response = flask.Response(status=304, mimetype=IMAGE_FORMATS[self.image_format])
+        response.set_etag(image_key)
+        if request.args.get("v") == image_key[:IMAGE_VERSION_LENGTH]:
+            response.cache_control.private = True
+            response.cache_control.max_age = 365 * 86400
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+
+class SleepDiarySvgView(SleepDiaryImageView):
+    image_format = "svg"
+
+
+class SleepActogramRangeView(View):
+    """
+    Serves an actogram of every night in the range as one PNG, double plotted with ?double=true.
+    Its ETag comes from the sleep stat's version and the render settings, so unchanged actograms are revalidated
+    without being rendered.
+    """
+
+    def __init__(self, data_source, start_hour: int):
+        super().__init__(data_source)
+        self.start_hour = start_hour
+
+    def get_path(self):
+        return "/sleep_time/actogram/<start_date:start_date>/<end_date:end_date>.png"
+
+    def call(self, **kwargs):
+        start_date = kwargs["start_date"]
+        end_date = kwargs["end_date"]
+        double_plotted = request.args.get("double", "false").lower() in ["true", "1"]
+        version = self.data_source.get_stat_version("sleep")
+        etag = None
+        if version is not None:
+            etag = f"{version_etag(version)}-{ACTOGRAM_RENDER_VERSION}-{self.start_hour}"
+            if not is_resource_modified(request.environ, etag=etag):
+                response = flask.Response(status=304, mimetype="image/png")
+                response.set_etag(etag)
+                return response
+        sleep_data_response = self.data_source.get_entries_for_stat_over_range(
+            "sleep", start_date, end_date, fields=RENDERED_FIELDS
+        )
+        sleeps = []
+        for entry in sleep_data_response:
+            try:
+                sleeps.append(FullSleepData(entry))
+            except (KeyError, CurrentlySleeping):
+                # Nights still in progress, or missing times, are left blank
+                continue
+        if not sleeps:
+            flask.abort(404)
+        actogram = Actogram(self.start_hour, double_plotted)
+        response = flask.Response(actogram.to_png(sleeps), mimetype="image/png")
+        if etag is not None:
+            response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+
+class SleepActogramView(SleepActogramRangeView):
+
+    def get_path(self):
+        return "/sleep_time/actogram.png"
+
+    def call(self, **kwargs):
+        return super().call(start_date="earliest", end_date="latest")
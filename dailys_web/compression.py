@@ -0,0 +1,91 @@
+import zlib
+from typing import Dict, Iterator, Iterable, Optional
+
+import flask
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, responses are only gzipped without it
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/csv",
+    "application/javascript",
+    "application/json",
+    "application/x-ndjson",
+    "image/svg+xml",
+}
+
+
+class ResponseCompressor:
+    """
+    Compresses responses with gzip, or brotli if it's installed, according to the client's Accept-Encoding.
+    Buffered responses are only compressed above a minimum size, streamed responses are compressed chunk by chunk, as
+    they are sent.
+    """
+
+    def __init__(self, config: Dict) -> None:
+        self.min_size = config.get("min_size", 500)
+        self.gzip_level = config.get("gzip_level", 6)
+        self.brotli_quality = config.get("brotli_quality", 4)
+
+    def register(self, app: flask.Flask) -> None:
+        app.after_request(self.compress_response)
+
+    def _choose_encoding(self) -> Optional[str]:
+        encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+        return request.accept_encodings.best_match(encodings)
+
+    def _compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def _compress_stream(self, chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+        # Each chunk is flushed, so clients can start decoding before the stream ends
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            for chunk in chunks:
+                yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+            return
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    def compress_response(self, response: flask.Response) -> flask.Response:
+        if response.status_code < 200 or response.status_code == 204:
+            return response
+        # Files sent directly, and responses which are already encoded, are left alone
+        if response.direct_passthrough or "Content-Encoding" in response.headers:
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self._choose_encoding()
+        if encoding is None:
+            return response
+        # The compressed body is a different representation, which only matches the uncompressed one weakly.
+        # ETags are weakened whenever an encoding is chosen, even for bodies too short to compress, so that 304s,
+        # which carry the mimetype but no body, send the same validator as the full response.
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        if response.status_code == 304:
+            return response
+        if response.is_streamed:
+            response.response = self._compress_stream(response.iter_encoded(), encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self._compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,49 @@
+from functools import wraps
+
+import flask
+from flask import request
+from werkzeug.http import is_resource_modified
+
+from dailys_web.data_source.data_source import StatVersion
+from dailys_web.streaming import wants_ndjson, NDJSON_MIMETYPE
+
+
+def version_etag(version: StatVersion) -> str:
+    # The update time is included, so that versions restarting on a fresh database don't match old ETags
+    return f"{version.version}-{int(version.updated_at.timestamp() * 1_000_000)}"
+
+
+def stat_etag(version: StatVersion) -> str:
+    etag = version_etag(version)
+    # The same URL can be served as JSON or NDJSON, so the representation is part of the ETag
+    if wants_ndjson():
+        etag += "-ndjson"
+    return etag
+
+
+def stat_conditional(func):
+    """
+    Handles conditional GETs for endpoints of a single stat, with ETag and Last-Modified headers from the stat's
+    version. Unchanged stats get a 304 response from one lookup, without the endpoint reading any entries.
+    """
+    @wraps(func)
+    def decorated_func(self, stat_name: str, **kws):
+        # Looked up before the endpoint reads entries, so a write in between can only make the response newer
+        version = self.data_source.get_stat_version(stat_name)
+        if version is None:
+            return func(self, stat_name, **kws)
+        etag = stat_etag(version)
+        if is_resource_modified(request.environ, etag=etag, last_modified=version.updated_at):
+            response = flask.make_response(func(self, stat_name, **kws))
+            if response.status_code != 200:
+                return response
+        else:
+            # With the mimetype the full response would have, so that it's handled the same way, such as by compression
+            response = flask.Response(status=304, mimetype=NDJSON_MIMETYPE if wants_ndjson() else "application/json")
+        response.set_etag(etag)
+        response.last_modified = version.updated_at
+        response.vary.add("Accept")
+        # Caches may keep responses, but must check they're current before using them
+        response.cache_control.no_cache = True
+        return response
+    return decorated_func
@@ -0,0 +1,164 @@
+import threading
+from typing import Set, Iterator, Iterable, Optional, List, Dict, Hashable, Callable, Any, Tuple
+
+from dailys_web.data_source.data_source import DataSource, DailysEntries, DailysDate, DailysEntry, DailysData, \
+    BulkProgressCallback, ValueCount, BulkProgress, StatQuery, DateRange, StatRanges, \
+    StatsEntries, StatVersion, Change
+from dailys_web.lru_cache import LRUCache, CacheStats
+
+# Stat names used in the cache keys of results which cover every stat
+ALL_STATS = None
+
+
+class CachingDataSource(DataSource):
+    """
+    Wraps another data source, memoising its read methods in an LRU cache.
+    Each stat has a version counter, and cache keys include the versions of every stat the result covers. A version is
+    bumped whenever that stat is written to, so that writes only invalidate the cached results covering that stat.
+    Results covering every stat are invalidated by any write.
+    """
+
+    def __init__(self, data_source: DataSource, max_entries: int = 256) -> None:
+        self.data_source = data_source
+        self.cache = LRUCache(max_entries)
+        self._versions_lock = threading.Lock()
+        self._versions: Dict[Optional[str], int] = {}
+        # Bumped by invalidate_all, to cover stats which haven't been versioned yet
+        self._epoch = 0
+
+    def _version(self, stat_names: Optional[Tuple[str, ...]]) -> Tuple[int, Tuple[int, ...]]:
+        with self._versions_lock:
+            if stat_names is ALL_STATS:
+                return self._epoch, (self._versions.get(ALL_STATS, 0),)
+            return self._epoch, tuple(self._versions.get(stat_name, 0) for stat_name in stat_names)
+
+    def invalidate_stat(self, stat_name: str) -> None:
+        with self._versions_lock:
+            self._versions[stat_name] = self._versions.get(stat_name, 0) + 1
+            self._versions[ALL_STATS] = self._versions.get(ALL_STATS, 0) + 1
+        # Stale results can no longer be looked up, but drop them now rather than waiting for them to be evicted
+        self.cache.remove_where(lambda key: key[0] is ALL_STATS or stat_name in key[0])
+
+    def invalidate_all(self) -> None:
+        with self._versions_lock:
+            self._epoch += 1
+        self.cache.clear()
+
+    def cache_stats(self) -> CacheStats:
+        return self.cache.stats()
+
+    def _cached(
+            self,
+            stat_names: Optional[Tuple[str, ...]],
+            key: Hashable,
+            fetch: Callable[[], Any],
+            copy: Callable[[Any], Any] = lambda result: result.copy()
+    ) -> Any:
+        # The versions are read before fetching, so a write which lands mid-fetch leaves this result unreachable
+        full_key = (stat_names, self._version(stat_names), key)
+        result = self.cache.get(full_key)
+        if result is None:
+            result = fetch()
+            self.cache.put(full_key, result)
+        # Callers get their own list, but the entries in it are shared with the cache, so aren't copied on every read.
+        # See DataSource: entries must be copied before being changed.
+        return copy(result)
+
+    def get_stat_version(self, stat_name: str) -> Optional[StatVersion]:
+        # Not cached, as this is what clients poll to find out whether anything changed
+        return self.data_source.get_stat_version(stat_name)
+
+    def get_changes_since(self, since: int, limit: int) -> List[Change]:
+        return self.data_source.get_changes_since(since, limit)
+
+    def get_unique_stat_names(self) -> Set[str]:
+        return self._cached(ALL_STATS, ("unique_stat_names",), self.data_source.get_unique_stat_names)
+
+    def get_entries_for_query(self, query: StatQuery) -> DailysEntries:
+        # Every range and date lookup goes through here, so this is the one place entries are cached
+        return self._cached(query.stat_names, query, lambda: self.data_source.get_entries_for_query(query))
+
+    def iter_entries_for_query(self, query: StatQuery) -> Iterator[DailysEntry]:
+        # Streaming reads are for results too big to hold, so they aren't cached
+        return self.data_source.iter_entries_for_query(query)
+
+    def get_entries_for_stats_over_range(
+            self,
+            stat_ranges: StatRanges,
+            include_static: Iterable[str] = ()
+    ) -> StatsEntries:
+        include_static = tuple(sorted(include_static))
+        stat_names = tuple(sorted(set(stat_ranges.keys()) | set(include_static)))
+        date_ranges = tuple(
+            (stat_name, DateRange.between(start_date, end_date))
+            for stat_name, (start_date, end_date) in sorted(stat_ranges.items())
+        )
+        return self._cached(
+            stat_names,
+            ("entries_for_stats_over_range", date_ranges, include_static),
+            lambda: self.data_source.get_entries_for_stats_over_range(stat_ranges, include_static),
+            lambda result: StatsEntries(
+                {stat_name: entries.copy() for stat_name, entries in result.entries.items()},
+                result.static.copy()
+            )
+        )
+
+    def get_static_entries_for_stat(self, stat_name: str) -> DailysEntries:
+        return self._cached(
+            (stat_name,),
+            ("static_entries_for_stat",),
+            lambda: self.data_source.get_static_entries_for_stat(stat_name)
+        )
+
+    def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
+        try:
+            return self.data_source.remove_stat_on_date(stat_name, view_date)
+        finally:
+            self.invalidate_stat(stat_name)
+
+    def get_value_counts_over_range(self, start_date: DailysDate, end_date: DailysDate) -> List[ValueCount]:
+        return self._cached(
+            ALL_STATS,
+            ("value_counts_over_range", DateRange.between(start_date, end_date)),
+            lambda: self.data_source.get_value_counts_over_range(start_date, end_date)
+        )
+
+    def update_entry_for_stat_on_date(
+            self,
+            stat_name: str,
+            update_date: DailysDate,
+            new_data: DailysData,
+            source: str
+    ) -> DailysEntry:
+        try:
+            return self.data_source.update_entry_for_stat_on_date(stat_name, update_date, new_data, source)
+        finally:
+            self.invalidate_stat(stat_name)
+
+    def update_entries_bulk(
+            self,
+            entries: Iterable[DailysEntry],
+            batch_size: int = 1000,
+            progress: Optional[BulkProgressCallback] = None
+    ) -> int:
+        stat_names = set()
+
+        def track_stat_names() -> Iterator[DailysEntry]:
+            for entry in entries:
+                stat_names.add(entry["stat_name"])
+                yield entry
+
+        def invalidate_written() -> None:
+            for stat_name in stat_names:
+                self.invalidate_stat(stat_name)
+
+        def on_batch(batch_progress: BulkProgress) -> None:
+            # Invalidate as each batch is committed, so that long imports don't leave stale results cached
+            invalidate_written()
+            if progress is not None:
+                progress(batch_progress)
+
+        try:
+            return self.data_source.update_entries_bulk(track_stat_names(), batch_size, on_batch)
+        finally:
+            invalidate_written()
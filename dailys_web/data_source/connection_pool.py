@@ -0,0 +1,199 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+import psycopg2
+from psycopg2.extensions import connection, TRANSACTION_STATUS_IDLE
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolStats(NamedTuple):
+    min_size: int
+    max_size: int
+    open: int
+    in_use: int
+    idle: int
+    waiting: int
+    total_leases: int
+    total_wait_seconds: float
+    max_wait_seconds: float
+    reconnects: int
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of postgres connections.
+    Callers lease a connection for the duration of a `with` block, and wait if all connections are in use.
+    Broken connections are discarded and replaced, rather than being handed back out.
+    """
+
+    def __init__(
+            self,
+            connect: Callable[[], connection],
+            min_size: int = 1,
+            max_size: int = 10,
+            timeout: float = 30,
+            ping_after: float = 60
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid connection pool size, min: {min_size}, max: {max_size}")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._lock = threading.Condition()
+        self._idle: List[connection] = []
+        self._last_used = {}
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._total_leases = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._reconnects = 0
+        for _ in range(min_size):
+            self._idle.append(self._new_connection())
+
+    def _new_connection(self) -> connection:
+        conn = self._connect()
+        self._open += 1
+        self._last_used[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn: connection) -> None:
+        self._last_used.pop(id(conn), None)
+        self._open -= 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_alive(self, conn: connection) -> bool:
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            return False
+        # Only ping connections which have been sitting idle a while, as the server may have dropped them
+        if time.monotonic() - self._last_used.get(id(conn), 0) < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _acquire(self) -> connection:
+        start = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+            try:
+                while not self._idle and self._open >= self.max_size:
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise PoolTimeout(f"Timed out waiting {self.timeout}s for a database connection")
+                    self._lock.wait(remaining)
+                conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    # Reserve the slot before connecting outside the lock
+                    self._open += 1
+                self._in_use += 1
+            finally:
+                self._waiting -= 1
+            waited = time.monotonic() - start
+            self._total_leases += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        if conn is None:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._lock.notify()
+                raise
+        if not self._is_alive(conn):
+            with self._lock:
+                self._discard(conn)
+                self._reconnects += 1
+                self._open += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._lock.notify()
+                raise
+        return conn
+
+    def _release(self, conn: connection, broken: bool) -> None:
+        with self._lock:
+            self._in_use -= 1
+            if broken or conn.closed:
+                # A replacement will be opened by the next caller which needs one
+                self._discard(conn)
+                self._reconnects += 1
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._idle.append(conn)
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, read_only: bool = False, autocommit: Optional[bool] = None) -> Iterator[connection]:
+        """
+        Leases a connection for the duration of the block.
+        Read only connections default to autocommit, so that they don't hold open a transaction.
+        Writes are committed when the block exits cleanly, and rolled back otherwise.
+        """
+        if autocommit is None:
+            autocommit = read_only
+        conn = self._acquire()
+        broken = False
+        try:
+            if conn.readonly != read_only or conn.autocommit != autocommit:
+                conn.set_session(readonly=read_only, autocommit=autocommit)
+            yield conn
+            if not conn.autocommit:
+                conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except BaseException:
+            if not conn.closed and not conn.autocommit:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(
+                min_size=self.min_size,
+                max_size=self.max_size,
+                open=self._open,
+                in_use=self._in_use,
+                idle=len(self._idle),
+                waiting=self._waiting,
+                total_leases=self._total_leases,
+                total_wait_seconds=self._total_wait,
+                max_wait_seconds=self._max_wait,
+                reconnects=self._reconnects
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._idle:
+                self._discard(conn)
+            self._idle = []
@@ -1,56 +1,335 @@
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import List, Dict, Any, Union, Set
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Any, Union, Set, Iterator, Iterable, NamedTuple, Callable, Optional, Tuple
+
+from dailys_web.data_source.json_paths import FieldPath, field_paths, project_data
 
 DailysData = Dict[str, Any]  # Just the "data" part of a DailysEntry
 DailysEntry = Dict[str, Any]  # A full dailys entry, with data, source, stat name, and date
 DailysEntries = List[DailysEntry]  # A list of dailys entries
 DailysDate = Union[datetime, str]  # A date, can be a datetime object, or "earliest", "latest", "static"
-# TODO: A better DailysDate might be nice, to ensure they're handled right.
-# - Make it a date rather than datetime
-# - Make the other values, (earliest, latest, static) into an enum, or constants
-# - Have StartDate and EndDate which do not allow latest and earliest, respectively
-#
-# class DailysEntry(TypedDict):
-#     stat_name: str
-#     source: str
-#     date: DailysDate
-#     data: DailysData
+# DailysDate is only taken at the edges, from URLs and callers. Queries use DateRange, of plain dates, where an open
+# end stands for "earliest" or "latest", and static entries are fetched separately.
 
 
 class CantUpdate(Exception):
     pass
 
 
+class BulkProgress(NamedTuple):
+    batch_number: int
+    batch_entries: int
+    total_entries: int
+    elapsed_seconds: float
+
+    @property
+    def entries_per_second(self) -> float:
+        if self.elapsed_seconds == 0:
+            return 0
+        return self.total_entries / self.elapsed_seconds
+
+    def __str__(self) -> str:
+        return (
+            f"Batch {self.batch_number}: wrote {self.batch_entries} entries, "
+            f"{self.total_entries} total in {self.elapsed_seconds:.2f}s ({self.entries_per_second:.0f} entries/s)"
+        )
+
+
+BulkProgressCallback = Callable[[BulkProgress], None]
+
+
+class ValueCount(NamedTuple):
+    # Totals for the entries of one stat, from one source, on one date
+    stat_name: str
+    date: date
+    source: str
+    entries: int
+    values: int
+
+
+class StatVersion(NamedTuple):
+    # Incremented by every write to the stat, static entry included
+    version: int
+    # When the stat was last written to, in UTC
+    updated_at: datetime
+
+
+class Change(NamedTuple):
+    # Position in the change feed. Each write moves the entry it wrote to a new, higher, position
+    seq: int
+    stat_name: str
+    # A date, or "static"
+    date: DailysDate
+    # The entry as it is now, or None if it has been removed
+    entry: Optional[DailysEntry]
+
+
+def to_date(view_date: DailysDate) -> date:
+    if isinstance(view_date, datetime):
+        return view_date.date()
+    return view_date
+
+
+class DateRange(NamedTuple):
+    """An inclusive range of dates, where a bound of None leaves that end of the range open"""
+    start: Optional[date] = None
+    end: Optional[date] = None
+
+    @classmethod
+    def between(cls, start_date: DailysDate, end_date: DailysDate) -> "DateRange":
+        return cls(
+            None if start_date == "earliest" else to_date(start_date),
+            None if end_date == "latest" else to_date(end_date)
+        )
+
+    @classmethod
+    def on(cls, view_date: DailysDate) -> "DateRange":
+        return cls(to_date(view_date), to_date(view_date))
+
+    def contains(self, stat_date: date) -> bool:
+        return (self.start is None or self.start <= stat_date) and (self.end is None or stat_date <= self.end)
+
+    def after(self, after_date: date) -> "DateRange":
+        """Narrows the range to dates strictly after the given date"""
+        start = after_date + timedelta(days=1)
+        if self.start is not None and self.start > start:
+            start = self.start
+        return self._replace(start=start)
+
+
+class _JsonPredicate(NamedTuple):
+    path: FieldPath
+    value: Union[str, int, float, None]
+
+
+class JsonPredicate(_JsonPredicate):
+    """
+    Matches entries whose data holds the given scalar value at the given path.
+    Values are compared as JSON: strings only match strings, and numbers only match numbers, never booleans. Booleans,
+    lists, and objects aren't supported as values, as backends can't all compare them alike.
+    """
+    __slots__ = ()
+
+    def __new__(cls, path: FieldPath, value: Union[str, int, float, None]) -> "JsonPredicate":
+        if value is not None and type(value) not in (str, int, float):
+            raise TypeError(f"Predicate values must be a string, number, or None, not {type(value).__name__}")
+        return super().__new__(cls, path, value)
+
+
+def json_equals(stored: Any, value: Union[str, int, float, None]) -> bool:
+    """Compares a value from an entry's data to a predicate's value, as JsonPredicate describes"""
+    if value is None or isinstance(value, str):
+        return type(stored) is type(value) and stored == value
+    return type(stored) in (int, float) and stored == value
+
+
+class StatQuery(NamedTuple):
+    """
+    A query for dated entries, which each data source compiles into a single query for its backend.
+    Static entries are never included. Queries are hashable, so they can be used as cache keys.
+    """
+    # Stats to fetch, or None for every stat
+    stat_names: Optional[Tuple[str, ...]] = None
+    date_range: DateRange = DateRange()
+    predicates: Tuple[JsonPredicate, ...] = ()
+    descending: bool = False
+    limit: Optional[int] = None
+    # Paths to include in each entry's data, or None for all of it
+    fields: Optional[Tuple[FieldPath, ...]] = None
+
+    @classmethod
+    def for_stat(cls, stat_name: str, **kwargs: Any) -> "StatQuery":
+        return cls(stat_names=(stat_name,), **kwargs)
+
+    @classmethod
+    def for_stat_on_date(cls, stat_name: str, view_date: DailysDate) -> "StatQuery":
+        if view_date == "earliest":
+            return cls.for_stat(stat_name, limit=1)
+        if view_date == "latest":
+            return cls.for_stat(stat_name, descending=True, limit=1)
+        return cls.for_stat(stat_name, date_range=DateRange.on(view_date))
+
+
+class StatsEntries(NamedTuple):
+    # Dated entries for each requested stat, in date order
+    entries: Dict[str, DailysEntries]
+    # Static entries, for those stats requested which have one
+    static: Dict[str, DailysEntry]
+
+
+StatRanges = Dict[str, Tuple[DailysDate, DailysDate]]  # Start and end dates to fetch, for each stat
+
+
+class EntriesPage(NamedTuple):
+    entries: DailysEntries
+    # Date of the last entry on this page, to fetch the next page after, or None if this is the last page
+    next_after: Optional[date]
+
+
+def project_entries(entries: DailysEntries, fields: Optional[Tuple[FieldPath, ...]]) -> DailysEntries:
+    if fields is None:
+        return entries
+    return [dict(entry, data=project_data(entry["data"], fields)) for entry in entries]
+
+
+def batched(entries: Iterable[DailysEntry], batch_size: int) -> Iterator[DailysEntries]:
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 class DataSource(ABC):
+    """
+    Entries returned may be shared with a cache, see CachingDataSource, so callers must copy entries, or their data,
+    before changing them.
+    """
 
     @abstractmethod
     def get_unique_stat_names(self) -> Set[str]:
         pass
 
+    def get_stat_version(self, stat_name: str) -> Optional[StatVersion]:
+        """
+        Looks up the version of a stat, without reading its entries, so that clients can skip refetching unchanged
+        stats. None if the stat hasn't been written to since versions were tracked, or the backend doesn't track them.
+        """
+        return None
+
     @abstractmethod
-    def get_entries_for_stat(self, stat_name: str) -> DailysEntries:
+    def get_changes_since(self, since: int, limit: int) -> List[Change]:
+        """
+        Lists entries written or removed after the given position in the change feed, in feed order, for clients
+        syncing incrementally. Each entry is listed once, at the position of its latest change.
+        """
         pass
 
     @abstractmethod
-    def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
+    def get_entries_for_query(self, query: StatQuery) -> DailysEntries:
         pass
 
     @abstractmethod
-    def get_entries_for_stat_on_date(self, stat_name: str, view_date: DailysDate) -> DailysEntries:
+    def iter_entries_for_query(self, query: StatQuery) -> Iterator[DailysEntry]:
+        """Like get_entries_for_query, but yields entries as they are read, rather than loading them all at once"""
         pass
 
     @abstractmethod
-    def get_entries_over_range(self, start_date: DailysDate, end_date: DailysDate) -> DailysEntries:
+    def get_static_entries_for_stat(self, stat_name: str) -> DailysEntries:
         pass
 
+    def get_entries_for_stat(self, stat_name: str, fields: Optional[Iterable[str]] = None) -> DailysEntries:
+        paths = field_paths(fields)
+        return (
+            self.get_entries_for_query(StatQuery.for_stat(stat_name, fields=paths))
+            + project_entries(self.get_static_entries_for_stat(stat_name), paths)
+        )
+
     @abstractmethod
+    def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
+        pass
+
+    def get_entries_for_stat_on_date(
+            self,
+            stat_name: str,
+            view_date: DailysDate,
+            fields: Optional[Iterable[str]] = None
+    ) -> DailysEntries:
+        paths = field_paths(fields)
+        if view_date == "static":
+            return project_entries(self.get_static_entries_for_stat(stat_name), paths)
+        return self.get_entries_for_query(StatQuery.for_stat_on_date(stat_name, view_date)._replace(fields=paths))
+
+    def get_entries_over_range(self, start_date: DailysDate, end_date: DailysDate) -> DailysEntries:
+        return self.get_entries_for_query(StatQuery(date_range=DateRange.between(start_date, end_date)))
+
     def get_entries_for_stat_over_range(
             self,
             stat_name: str,
             start_date: DailysDate,
-            end_date: DailysDate
+            end_date: DailysDate,
+            fields: Optional[Iterable[str]] = None
     ) -> DailysEntries:
+        """
+        Fetches a stat's entries over a date range.
+        If fields are given, as dotted paths, entries' data only includes those fields, which backends extract
+        in the query, rather than loading whole entries.
+        """
+        return self.get_entries_for_query(StatQuery.for_stat(
+            stat_name,
+            date_range=DateRange.between(start_date, end_date),
+            fields=field_paths(fields)
+        ))
+
+    def iter_entries_over_range(self, start_date: DailysDate, end_date: DailysDate) -> Iterator[DailysEntry]:
+        return self.iter_entries_for_query(StatQuery(date_range=DateRange.between(start_date, end_date)))
+
+    def iter_entries_for_stat_over_range(
+            self,
+            stat_name: str,
+            start_date: DailysDate,
+            end_date: DailysDate,
+            fields: Optional[Iterable[str]] = None
+    ) -> Iterator[DailysEntry]:
+        return self.iter_entries_for_query(StatQuery.for_stat(
+            stat_name,
+            date_range=DateRange.between(start_date, end_date),
+            fields=field_paths(fields)
+        ))
+
+    def get_page_for_stat_over_range(
+            self,
+            stat_name: str,
+            start_date: DailysDate,
+            end_date: DailysDate,
+            limit: int,
+            after: Optional[date] = None,
+            fields: Optional[Iterable[str]] = None
+    ) -> EntriesPage:
+        """
+        Fetches up to limit of a stat's entries over a date range, in date order, starting after the given date.
+        Paging on the date, rather than an offset, means each page is an index range scan, however deep it is.
+        """
+        date_range = DateRange.between(start_date, end_date)
+        if after is not None:
+            date_range = date_range.after(after)
+        # Fetch one extra entry, to tell whether there is another page without counting them
+        entries = self.get_entries_for_query(StatQuery.for_stat(
+            stat_name,
+            date_range=date_range,
+            limit=limit + 1,
+            fields=field_paths(fields)
+        ))
+        if len(entries) <= limit:
+            return EntriesPage(entries, None)
+        entries = entries[:limit]
+        return EntriesPage(entries, to_date(entries[-1]["date"]))
+
+    def get_entries_for_stats_over_range(
+            self,
+            stat_ranges: StatRanges,
+            include_static: Iterable[str] = ()
+    ) -> StatsEntries:
+        """
+        Fetches entries for several stats, each over its own date range, along with the static entries of any stats
+        listed in include_static. Backends which can should override this to fetch everything in one query.
+        """
+        entries = {
+            stat_name: self.get_entries_for_stat_over_range(stat_name, start_date, end_date)
+            for stat_name, (start_date, end_date) in stat_ranges.items()
+        }
+        static = {}
+        for stat_name in include_static:
+            for static_entry in self.get_static_entries_for_stat(stat_name):
+                static[stat_name] = static_entry
+        return StatsEntries(entries, static)
+
+    @abstractmethod
+    def get_value_counts_over_range(self, start_date: DailysDate, end_date: DailysDate) -> List[ValueCount]:
+        """Counts entries and values for each stat, date, and source, ordered by date"""
         pass
 
     @abstractmethod
@@ -63,5 +342,17 @@ class DataSource(ABC):
         pass
 
     @abstractmethod
-    def get_latest_n_entries_for_stat(self, stat_name: str, n: int) -> DailysEntries:
+    def update_entries_bulk(
+            self,
+            entries: Iterable[DailysEntry],
+            batch_size: int = 1000,
+            progress: Optional[BulkProgressCallback] = None
+    ) -> int:
+        """
+        Writes many entries, each batch of them in a single transaction.
+        Calls progress after each batch, and returns the total number of entries written.
+        """
         pass
+
+    def get_latest_n_entries_for_stat(self, stat_name: str, n: int) -> DailysEntries:
+        return self.get_entries_for_query(StatQuery.for_stat(stat_name, descending=True, limit=n))
@@ -1,22 +1,45 @@
-from datetime import datetime, time, timedelta
-from typing import Set, List
+import itertools
+from collections import defaultdict
+from datetime import datetime, time, timedelta, date
+from time import perf_counter
+from typing import Set, List, Iterator, Optional, Iterable, Tuple, Union, Dict
+from urllib.parse import quote
 
 import firebase_admin
 from firebase_admin import firestore
-from google.cloud.firestore_v1 import DocumentSnapshot, Query
+from google.cloud.firestore_v1 import DocumentSnapshot, Query, DocumentReference, Transaction
 
+from dailys_models.value_counts import count_values
 from dailys_web.data_source.data_source import DataSource, DailysEntries, DailysDate, DailysData, DailysEntry, \
-    CantUpdate
+    CantUpdate, BulkProgressCallback, batched, BulkProgress, ValueCount, StatQuery, DateRange, to_date, Change
 
 min_date = datetime(1, 1, 1, 0, 0, 0)
 max_date = datetime(9999, 12, 30, 12, 0, 0)
+DocumentKey = Tuple[str, Union[date, str]]  # Stat name, and date or "static"
+# Transactions are limited to 500 writes, and each entry written also writes its change, besides the feed's counter
+MAX_BATCH_SIZE = 249
+
+
+def date_string(entry_date: Union[date, str]) -> str:
+    return entry_date if entry_date == "static" else entry_date.isoformat()
+
+
+def change_id(key: DocumentKey) -> str:
+    # One change document per entry, with an ID quoted so that stat names can't add slashes to its path
+    return quote(f"{key[0]}:{date_string(key[1])}", safe="")
 
 
 class FirestoreDataSource(DataSource):
 
-    def __init__(self):
+    def __init__(self, page_size: int = 500):
         firebase_admin.initialize_app()
-        self.data_source = firestore.client().collection('Dailys stats')
+        self.client = firestore.client()
+        self.data_source = self.client.collection('Dailys stats')
+        # The change feed keeps one document per entry, live or removed, with the entry's latest position, and a
+        # copy of the entry, so that it can be read in one query
+        self.changes = self.client.collection('Dailys changes')
+        self.change_counter = self.client.collection('Dailys meta').document('change_feed')
+        self.page_size = page_size
 
     def get_unique_stat_names(self) -> Set[str]:
         unique_names = set()
@@ -25,81 +48,136 @@ class FirestoreDataSource(DataSource):
                 unique_names.add(stat.get("stat_name"))
         return unique_names
 
-    def get_entries_for_stat(self, stat_name: str) -> DailysEntries:
+    def get_static_entries_for_stat(self, stat_name: str) -> DailysEntries:
         return [
             x.to_dict()
             for x
-            in self.data_source.where("stat_name", "==", stat_name).order_by("date").get()
+            in self.data_source.where("stat_name", "==", stat_name).where("date", "==", "static").get()
         ]
 
     def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
         docs = self._get_documents_for_stat_on_date(stat_name, view_date)
         if len(docs) == 0:
             raise KeyError
-        for doc in docs:
-            doc.reference.delete()
+        key = (stat_name, "static" if view_date == "static" else to_date(view_date))
+        self._write_with_changes([(key, [doc.reference for doc in docs], None)])
+
+    def _write_with_changes(
+            self,
+            writes: List[Tuple[DocumentKey, List[DocumentReference], Optional[DailysEntry]]]
+    ) -> None:
+        """
+        In one transaction, sets each entry to the given documents, or deletes them where the entry is None, and gives
+        each entry the next position in the change feed. Every transaction reads and bumps the feed's counter, so
+        writers take turns, and clients reading the feed can't miss a change committed after a later position.
+        """
+        @firestore.transactional
+        def write(transaction: Transaction) -> None:
+            counter = self.change_counter.get(transaction=transaction)
+            seq = counter.get("seq") if counter.exists else 0
+            for key, doc_refs, entry in writes:
+                for doc_ref in doc_refs:
+                    if entry is None:
+                        transaction.delete(doc_ref)
+                    else:
+                        transaction.set(doc_ref, entry)
+                seq += 1
+                transaction.set(self.changes.document(change_id(key)), {
+                    "stat_name": key[0],
+                    "stat_date": date_string(key[1]),
+                    "seq": seq,
+                    "entry": entry
+                })
+            transaction.set(self.change_counter, {"seq": seq})
+        write(self.client.transaction())
+
+    def get_changes_since(self, since: int, limit: int) -> List[Change]:
+        changes = []
+        for doc in self.changes.where("seq", ">", since).order_by("seq").limit(limit).stream():
+            change = doc.to_dict()
+            change_date = change["stat_date"]
+            if change_date != "static":
+                change_date = datetime.combine(date.fromisoformat(change_date), time(0, 0, 0))
+            entry = change["entry"]
+            if entry is not None:
+                entry["date"] = change_date
+            changes.append(Change(change["seq"], change["stat_name"], change_date, entry))
+        return changes
+
+    def build_change_feed(self, progress: Optional[BulkProgressCallback] = None) -> int:
+        """
+        Adds every entry to the change feed, for data written before the feed was kept. Run it once, before clients
+        start syncing from the feed.
+        """
+        start_time = perf_counter()
+        total = 0
+        statics = (doc.to_dict() for doc in self.data_source.where("date", "==", "static").stream())
+        entries = itertools.chain(self.iter_entries_over_range("earliest", "latest"), statics)
+        for batch_number, batch in enumerate(batched(entries, MAX_BATCH_SIZE * 2), start=1):
+            # Only the changes are written, so batches can be twice as large
+            self._write_with_changes([(self._document_key(entry), [], entry) for entry in batch])
+            total += len(batch)
+            if progress is not None:
+                progress(BulkProgress(batch_number, len(batch), total, perf_counter() - start_time))
+        return total
 
     def _get_documents_for_stat_on_date(self, stat_name: str, view_date: DailysDate) -> List[DocumentSnapshot]:
-        data_partial = self.data_source.where("stat_name", "==", stat_name)
-        if view_date == "earliest":
-            data_partial = data_partial\
-                .where("date", ">=", min_date)\
-                .order_by("date", direction=Query.ASCENDING)\
-                .limit(1)
-        elif view_date == "latest":
-            data_partial = data_partial\
-                .where("date", "<=", max_date)\
-                .order_by("date", direction=Query.DESCENDING)\
-                .limit(1)
-        elif view_date == "static":
-            data_partial = data_partial.where("date", "==", "static")
+        if view_date == "static":
+            return list(self.data_source.where("stat_name", "==", stat_name).where("date", "==", "static").get())
+        query = StatQuery.for_stat_on_date(stat_name, view_date)
+        return list(self._compile(query).limit(query.limit or self.page_size).get())
+
+    def _compile(self, query: StatQuery) -> Query:
+        data_partial = self.data_source
+        if query.stat_names is not None:
+            if len(query.stat_names) == 1:
+                data_partial = data_partial.where("stat_name", "==", query.stat_names[0])
+            else:
+                data_partial = data_partial.where("stat_name", "in", list(query.stat_names))
+        # Dates are always bounded, as static entries are stored with a date of "static"
+        start = query.date_range.start
+        end = query.date_range.end
+        data_partial = data_partial.where("date", ">=", min_date if start is None else datetime.combine(start, time()))
+        if end is None:
+            data_partial = data_partial.where("date", "<=", max_date)
         else:
-            start_datetime = datetime.combine(view_date, time(0, 0, 0))
-            end_datetime = datetime.combine(view_date + timedelta(days=1), time(0, 0, 0))
-            data_partial = data_partial.where("date", ">=", start_datetime).where("date", "<", end_datetime)
-        return list(data_partial.get())
+            data_partial = data_partial.where("date", "<", datetime.combine(end + timedelta(days=1), time()))
+        for predicate in query.predicates:
+            data_partial = data_partial.where(".".join(("data",) + predicate.path), "==", predicate.value)
+        if query.fields is not None:
+            data_partial = data_partial.select(
+                ["stat_name", "date", "source"] + [".".join(("data",) + path) for path in query.fields]
+            )
+        direction = Query.DESCENDING if query.descending else Query.ASCENDING
+        return data_partial.order_by("date", direction=direction)
 
-    def get_entries_for_stat_on_date(self, stat_name: str, view_date: DailysDate) -> DailysEntries:
-        return [x.to_dict() for x in self._get_documents_for_stat_on_date(stat_name, view_date)]
+    def iter_entries_for_query(self, query: StatQuery) -> Iterator[DailysEntry]:
+        firestore_query = self._compile(query)
+        remaining = query.limit
+        last_doc = None
+        while remaining is None or remaining > 0:
+            page_size = self.page_size if remaining is None else min(self.page_size, remaining)
+            page = firestore_query.limit(page_size)
+            if last_doc is not None:
+                page = page.start_after(last_doc)
+            page_count = 0
+            for doc in page.stream():
+                page_count += 1
+                last_doc = doc
+                entry = doc.to_dict()
+                if query.fields is not None:
+                    entry.setdefault("data", {})
+                yield entry
+            if remaining is not None:
+                remaining -= page_count
+            if page_count < page_size:
+                return
 
-    def get_entries_over_range(self, start_date: DailysDate, end_date: DailysDate) -> DailysEntries:
-        data_partial = self.data_source
-        # Filter start date
-        if start_date != "earliest":
-            start_datetime = datetime.combine(start_date, time(0, 0, 0))
-            data_partial = data_partial.where("date", ">=", start_datetime)
-        # Filter end date
-        if end_date != "latest":
-            end_datetime = datetime.combine(end_date + timedelta(days=1), time(0, 0, 0))
-            data_partial = data_partial.where("date", "<=", end_datetime)
-        # Collapse data to dicts
-        stat_list = [x.to_dict() for x in data_partial.order_by("date").get()]
-        # If date range is unbounded, filter out static data
-        if start_date == "earliest" and end_date == "latest":
-            stat_list = [x for x in stat_list if x['date'] != 'static']
-        return stat_list
-
-    def get_entries_for_stat_over_range(
-            self,
-            stat_name: str,
-            start_date: DailysDate,
-            end_date: DailysDate
-    ) -> DailysEntries:
-        data_partial = self.data_source.where("stat_name", "==", stat_name)
-        # Filter start date
-        if start_date != "earliest":
-            start_datetime = datetime.combine(start_date, time(0, 0, 0))
-            data_partial = data_partial.where("date", ">=", start_datetime)
-        # Filter end date
-        if end_date != "latest":
-            end_datetime = datetime.combine(end_date + timedelta(days=1), time(0, 0, 0))
-            data_partial = data_partial.where("date", "<=", end_datetime)
-        # Collapse data to dicts
-        data = [x.to_dict() for x in data_partial.order_by("date").get()]
-        # If date range is unbounded, filter out static data
-        if start_date == "earliest" and end_date == "latest":
-            data = [x for x in data if x['date'] != 'static']
-        return data
+    def get_entries_for_query(self, query: StatQuery) -> DailysEntries:
+        return list(self.iter_entries_for_query(query))
+
+    def get_value_counts_over_range(self, start_date: DailysDate, end_date: DailysDate) -> List[ValueCount]:
+        return count_values(self.iter_entries_over_range(start_date, end_date))
 
     def update_entry_for_stat_on_date(
             self,
@@ -107,6 +185,14 @@ class FirestoreDataSource(DataSource):
             update_date: DailysDate,
             new_data: DailysData,
             source: str) -> DailysEntry:
+        total_data = self._total_data(stat_name, update_date, new_data, source)
+        # See if data exists
+        data = self._get_documents_for_stat_on_date(stat_name, update_date)
+        doc_ref = self.data_source.document(data[0].id) if len(data) == 1 else self.data_source.document()
+        self._write_with_changes([(self._document_key(total_data), [doc_ref], total_data)])
+        return total_data
+
+    def _total_data(self, stat_name: str, update_date: DailysDate, new_data: DailysData, source: str) -> DailysEntry:
         # Construct new data object
         total_data = {'stat_name': stat_name}
         if update_date in ["earliest", "latest"]:
@@ -117,17 +203,60 @@ class FirestoreDataSource(DataSource):
             total_data['date'] = datetime.combine(update_date, time(0, 0, 0))
         total_data['source'] = source or "Unknown [via API]"
         total_data['data'] = new_data
-        # See if data exists
-        data = self._get_documents_for_stat_on_date(stat_name, update_date)
-        if len(data) == 1:
-            self.data_source.document(data[0].id).set(total_data)
-        else:
-            self.data_source.add(total_data)
         return total_data
 
-    def get_latest_n_entries_for_stat(self, stat_name: str, n: int) -> DailysEntries:
-        raw_data = self.data_source.where("stat_name", "==", stat_name)\
-            .where("date", "<", max_date)\
-            .order_by("date", direction=Query.DESCENDING).limit(n).get()
-        entries = [x.to_dict() for x in raw_data]
-        return entries
\ No newline at end of file
+    @staticmethod
+    def _document_key(entry: DailysEntry) -> DocumentKey:
+        entry_date = entry["date"]
+        return entry["stat_name"], entry_date if entry_date == "static" else to_date(entry_date)
+
+    def _document_ids(self, keys: Iterable[DocumentKey]) -> Dict[DocumentKey, List[str]]:
+        """
+        Finds the IDs of the documents already stored for each of the given stats and dates, with one query for each
+        stat's dates, rather than one for each entry
+        """
+        stat_dates = defaultdict(set)
+        for stat_name, entry_date in keys:
+            stat_dates[stat_name].add(entry_date)
+        doc_ids = defaultdict(list)
+        for stat_name, entry_dates in stat_dates.items():
+            if "static" in entry_dates:
+                entry_dates.remove("static")
+                for doc in self._get_documents_for_stat_on_date(stat_name, "static"):
+                    doc_ids[(stat_name, "static")].append(doc.id)
+            if not entry_dates:
+                continue
+            query = StatQuery.for_stat(stat_name, date_range=DateRange(min(entry_dates), max(entry_dates)), fields=())
+            for doc in self._compile(query).stream():
+                key = (stat_name, to_date(doc.get("date")))
+                if key[1] in entry_dates:
+                    doc_ids[key].append(doc.id)
+        return doc_ids
+
+    def update_entries_bulk(
+            self,
+            entries: Iterable[DailysEntry],
+            batch_size: int = 1000,
+            progress: Optional[BulkProgressCallback] = None
+    ) -> int:
+        start_time = perf_counter()
+        total = 0
+        batch_size = min(batch_size, MAX_BATCH_SIZE)
+        for batch_number, batch in enumerate(batched(entries, batch_size), start=1):
+            # Keyed so that a repeated entry within a batch overwrites the earlier one, rather than each adding a
+            # document for the same new date
+            batch_data = {}
+            for entry in batch:
+                total_data = self._total_data(entry["stat_name"], entry["date"], entry["data"], entry["source"])
+                batch_data[self._document_key(total_data)] = total_data
+            doc_ids = self._document_ids(batch_data.keys())
+            writes = []
+            for key, total_data in batch_data.items():
+                ids = doc_ids.get(key, [])
+                doc_ref = self.data_source.document(ids[0]) if len(ids) == 1 else self.data_source.document()
+                writes.append((key, [doc_ref], total_data))
+            self._write_with_changes(writes)
+            total += len(batch)
+            if progress is not None:
+                progress(BulkProgress(batch_number, len(batch), total, perf_counter() - start_time))
+        return total
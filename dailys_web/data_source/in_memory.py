@@ -0,0 +1,232 @@
+import copy
+import heapq
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, time, date, timezone
+from itertools import islice, takewhile
+from time import perf_counter
+from typing import Dict, Set, List, Iterator, Optional, Iterable, TextIO, Tuple, Union
+
+from dailys_models.value_counts import count_values
+from dailys_web.data_source.data_source import DailysEntry, DataSource, DailysEntries, DailysDate, DailysData, \
+    BulkProgressCallback, batched, CantUpdate, BulkProgress, ValueCount, StatQuery, DateRange, to_date, StatVersion, \
+    Change
+from dailys_web.data_source.json_paths import project_data
+from dailys_web.data_source.query import matches
+
+
+def _copy_entry(entry: DailysEntry) -> DailysEntry:
+    return dict(entry, data=copy.deepcopy(entry["data"]))
+
+
+class InMemoryDataSource(DataSource):
+    """
+    Holds every entry in memory, for tests, benchmarks, and as a read replica of a slower data source.
+    Each stat's entries are kept in date order, alongside a sorted list of their dates, so that lookups and ranges are
+    binary searches. Entries and their data are copied on the way in and out, so callers can't change the store by
+    changing what they were given.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._dates: Dict[str, List[date]] = {}
+        self._entries: Dict[str, DailysEntries] = {}
+        self._static: Dict[str, DailysEntry] = {}
+        self._versions: Dict[str, StatVersion] = {}
+        # Change feed positions of each entry, by stat name and date or "static", kept in position order
+        self._changes: OrderedDict[Tuple[str, Union[date, str]], int] = OrderedDict()
+        self._last_seq = 0
+
+    @classmethod
+    def from_data_source(cls, data_source: DataSource) -> "InMemoryDataSource":
+        """Copies every entry from another data source"""
+        in_memory = cls()
+        in_memory.update_entries_bulk(data_source.iter_entries_over_range("earliest", "latest"))
+        for stat_name in data_source.get_unique_stat_names():
+            in_memory.update_entries_bulk(data_source.get_entries_for_stat_on_date(stat_name, "static"))
+        return in_memory
+
+    @classmethod
+    def load_ndjson(cls, lines: Iterable[str]) -> "InMemoryDataSource":
+        """Loads entries from newline delimited JSON, one entry per line, with ISO dates, or "static" """
+        in_memory = cls()
+        in_memory.update_entries_bulk(
+            cls._entry_from_json(json.loads(line))
+            for line in lines if line.strip()
+        )
+        return in_memory
+
+    def dump_ndjson(self, output: TextIO) -> int:
+        """Writes every entry as newline delimited JSON, in the format read by load_ndjson(). Returns the entry count"""
+        count = 0
+        with self._lock:
+            entries = [entry for stat_entries in self._entries.values() for entry in stat_entries]
+            entries += list(self._static.values())
+        for entry in entries:
+            output.write(json.dumps(self._entry_to_json(entry)) + "\n")
+            count += 1
+        return count
+
+    @staticmethod
+    def _entry_from_json(entry_json: Dict) -> DailysEntry:
+        if entry_json["date"] != "static":
+            entry_json["date"] = datetime.combine(date.fromisoformat(entry_json["date"]), time(0, 0, 0))
+        return entry_json
+
+    @staticmethod
+    def _entry_to_json(entry: DailysEntry) -> Dict:
+        entry_json = dict(entry)
+        if entry_json["date"] != "static":
+            entry_json["date"] = entry_json["date"].date().isoformat()
+        return entry_json
+
+    def get_unique_stat_names(self) -> Set[str]:
+        with self._lock:
+            return set(self._entries.keys()) | set(self._static.keys())
+
+    def get_stat_version(self, stat_name: str) -> Optional[StatVersion]:
+        with self._lock:
+            return self._versions.get(stat_name)
+
+    def _record_change(self, stat_name: str, change_date: Union[date, str]) -> None:
+        version = self._versions.get(stat_name)
+        next_version = 1 if version is None else version.version + 1
+        self._versions[stat_name] = StatVersion(next_version, datetime.now(timezone.utc))
+        self._last_seq += 1
+        self._changes[(stat_name, change_date)] = self._last_seq
+        self._changes.move_to_end((stat_name, change_date))
+
+    def _current_entry(self, stat_name: str, change_date: Union[date, str]) -> Optional[DailysEntry]:
+        if change_date == "static":
+            return self._static.get(stat_name)
+        dates = self._dates.get(stat_name, [])
+        index = bisect_left(dates, change_date)
+        if index < len(dates) and dates[index] == change_date:
+            return self._entries[stat_name][index]
+        return None
+
+    def get_changes_since(self, since: int, limit: int) -> List[Change]:
+        with self._lock:
+            # Walk back from the latest change, so this only costs as much as the changes since
+            keys = list(takewhile(lambda key: self._changes[key] > since, reversed(self._changes)))[::-1][:limit]
+            changes = []
+            for stat_name, change_date in keys:
+                entry = self._current_entry(stat_name, change_date)
+                changes.append(Change(
+                    self._changes[(stat_name, change_date)],
+                    stat_name,
+                    change_date if change_date == "static" else datetime.combine(change_date, time(0, 0, 0)),
+                    None if entry is None else _copy_entry(entry)
+                ))
+            return changes
+
+    def get_static_entries_for_stat(self, stat_name: str) -> DailysEntries:
+        with self._lock:
+            return [_copy_entry(self._static[stat_name])] if stat_name in self._static else []
+
+    def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
+        if view_date in ["earliest", "latest"]:
+            raise ValueError("Cannot delete earliest/latest stat entry")
+        with self._lock:
+            if view_date == "static":
+                self._static.pop(stat_name, None)
+                self._record_change(stat_name, "static")
+                return
+            self._record_change(stat_name, to_date(view_date))
+            dates = self._dates.get(stat_name, [])
+            index = bisect_left(dates, to_date(view_date))
+            if index < len(dates) and dates[index] == to_date(view_date):
+                del dates[index]
+                del self._entries[stat_name][index]
+            if not dates:
+                self._dates.pop(stat_name, None)
+                self._entries.pop(stat_name, None)
+
+    def _stat_slice(self, stat_name: str, date_range: DateRange) -> DailysEntries:
+        dates = self._dates.get(stat_name, [])
+        if not dates:
+            return []
+        start = 0 if date_range.start is None else bisect_left(dates, date_range.start)
+        end = len(dates) if date_range.end is None else bisect_right(dates, date_range.end)
+        return self._entries[stat_name][start:end]
+
+    def iter_entries_for_query(self, query: StatQuery) -> Iterator[DailysEntry]:
+        with self._lock:
+            stat_names = list(self._entries.keys()) if query.stat_names is None else query.stat_names
+            stat_slices = [self._stat_slice(stat_name, query.date_range) for stat_name in stat_names]
+        if query.descending:
+            stat_slices = [reversed(stat_slice) for stat_slice in stat_slices]
+        entries = heapq.merge(
+            *stat_slices,
+            key=lambda entry: (entry["date"], entry["stat_name"]),
+            reverse=query.descending
+        )
+        if query.predicates:
+            entries = (entry for entry in entries if matches(entry, query))
+        for entry in islice(entries, query.limit):
+            if query.fields is None:
+                yield _copy_entry(entry)
+            else:
+                yield dict(entry, data=copy.deepcopy(project_data(entry["data"], query.fields)))
+
+    def get_entries_for_query(self, query: StatQuery) -> DailysEntries:
+        return list(self.iter_entries_for_query(query))
+
+    def get_value_counts_over_range(self, start_date: DailysDate, end_date: DailysDate) -> List[ValueCount]:
+        return count_values(self.get_entries_over_range(start_date, end_date))
+
+    def _write_entry(self, entry: DailysEntry) -> None:
+        stat_name = entry["stat_name"]
+        if entry["date"] in ["earliest", "latest"]:
+            raise CantUpdate("Can't update data on earliest/latest")
+        if entry["date"] == "static":
+            self._static[stat_name] = _copy_entry(entry)
+            self._record_change(stat_name, "static")
+            return
+        stat_date = to_date(entry["date"])
+        self._record_change(stat_name, stat_date)
+        stored = dict(entry, date=datetime.combine(stat_date, time(0, 0, 0)), data=copy.deepcopy(entry["data"]))
+        dates = self._dates.setdefault(stat_name, [])
+        entries = self._entries.setdefault(stat_name, [])
+        # Entries mostly arrive in date order, so check for an append before searching
+        if not dates or dates[-1] < stat_date:
+            dates.append(stat_date)
+            entries.append(stored)
+            return
+        index = bisect_left(dates, stat_date)
+        if dates[index] == stat_date:
+            entries[index] = stored
+        else:
+            dates.insert(index, stat_date)
+            entries.insert(index, stored)
+
+    def update_entry_for_stat_on_date(
+            self,
+            stat_name: str,
+            update_date: DailysDate,
+            new_data: DailysData,
+            source: str
+    ) -> DailysEntry:
+        if update_date in ["earliest", "latest"]:
+            raise ValueError("Can't update data on earliest/latest")
+        with self._lock:
+            self._write_entry({"stat_name": stat_name, "source": source, "date": update_date, "data": new_data})
+
+    def update_entries_bulk(
+            self,
+            entries: Iterable[DailysEntry],
+            batch_size: int = 1000,
+            progress: Optional[BulkProgressCallback] = None
+    ) -> int:
+        start_time = perf_counter()
+        total = 0
+        for batch_number, batch in enumerate(batched(entries, batch_size), start=1):
+            with self._lock:
+                for entry in batch:
+                    self._write_entry(entry)
+            total += len(batch)
+            if progress is not None:
+                progress(BulkProgress(batch_number, len(batch), total, perf_counter() - start_time))
+        return total
@@ -0,0 +1,42 @@
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+FieldPath = Tuple[str, ...]  # Path of keys into an entry's data
+
+
+def field_paths(fields: Optional[Iterable[str]]) -> Optional[Tuple[FieldPath, ...]]:
+    """
+    Parses dotted field names, such as "sleep_time" or "WakeUpTime.happiness", into paths. Paths only lead through
+    nested objects, not into arrays, so a path such as "interruptions.wake_time" matches nothing.
+    """
+    if fields is None:
+        return None
+    return tuple(tuple(field.split(".")) for field in fields if field)
+
+
+# Sentinel for paths which aren't present in an entry's data
+MISSING = object()
+
+
+def value_at_path(data: Dict[str, Any], path: FieldPath) -> Any:
+    value = data
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+def set_at_path(data: Dict[str, Any], path: FieldPath, value: Any) -> None:
+    for key in path[:-1]:
+        data = data.setdefault(key, {})
+    data[path[-1]] = value
+
+
+def project_data(data: Dict[str, Any], fields: Iterable[FieldPath]) -> Dict[str, Any]:
+    """Builds a copy of data holding only the given paths, skipping any which are missing"""
+    projected = {}
+    for path in fields:
+        value = value_at_path(data, path)
+        if value is not MISSING:
+            set_at_path(projected, path, value)
+    return projected
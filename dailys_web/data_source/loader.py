@@ -0,0 +1,28 @@
+from typing import Dict
+
+from dailys_web.data_source.data_source import DataSource
+
+
+def load_data_source(db_config: Dict) -> DataSource:
+    """Creates the data source configured by the "type" of the database config, defaulting to postgres"""
+    # Backends are imported as needed, so that installs don't need the drivers for backends they don't use
+    db_type = db_config.get("type", "postgres")
+    if db_type == "postgres":
+        from dailys_web.data_source.postgres import PostgresDataSource
+        database = PostgresDataSource(db_config)
+        if db_config.get("auto_migrate", True):
+            database.migrate()
+        return database
+    if db_type == "sqlite":
+        from dailys_web.data_source.sqlite import SqliteDataSource
+        return SqliteDataSource(db_config)
+    if db_type == "firestore":
+        from dailys_web.data_source.firestore import FirestoreDataSource
+        return FirestoreDataSource(db_config.get("page_size", 500))
+    if db_type == "memory":
+        from dailys_web.data_source.in_memory import InMemoryDataSource
+        if "path" not in db_config:
+            return InMemoryDataSource()
+        with open(db_config["path"], "r") as f:
+            return InMemoryDataSource.load_ndjson(f)
+    raise ValueError(f"Unrecognised database type: {db_type}")
@@ -1,11 +1,22 @@
 import json
-from datetime import datetime, time
-from typing import Dict, Set, List
+from contextlib import contextmanager
+from datetime import datetime, time, date, timezone
+from time import perf_counter
+from typing import Dict, Set, List, Iterator, Optional, Tuple, Iterable, Callable
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 
-from dailys_web.data_source.data_source import DailysEntry, DataSource, DailysEntries, DailysDate, DailysData
+from dailys_models.value_counts import stored_value_count
+from dailys_web.data_source.connection_pool import ConnectionPool, PoolStats
+from dailys_web.data_source.postgres_migrations import migrate, Migration, VALUE_COUNTS_MIGRATION
+from dailys_web.data_source.postgres_partitions import ensure_partitions
+from dailys_web.data_source.postgres_listener import PostgresChangeListener, CHANGE_CHANNEL, change_payload
+from dailys_web.data_source.data_source import DailysEntry, DataSource, DailysEntries, DailysDate, DailysData, \
+    BulkProgressCallback, batched, CantUpdate, BulkProgress, ValueCount, StatQuery, DateRange, StatRanges, \
+    StatsEntries, StatVersion, Change
+from dailys_web.data_source.json_paths import set_at_path
+from dailys_web.data_source.query import queries_for_stat_ranges, group_by_stat
 
 
 def entry_from_row(row: Dict) -> DailysEntry:
@@ -17,6 +28,21 @@ def entry_from_row(row: Dict) -> DailysEntry:
     }
 
 
+def entry_from_query_row(row: Dict, query: StatQuery) -> DailysEntry:
+    if query.fields is None:
+        return entry_from_row(row)
+    data = {}
+    for index, path in enumerate(query.fields):
+        if row[f"field_{index}"] is not None:
+            set_at_path(data, path, json.loads(row[f"field_{index}"]))
+    return {
+        "stat_name": row["stat_name"],
+        "source": row["source"],
+        "date": datetime.combine(row["stat_date"], time(0, 0, 0)),
+        "data": data
+    }
+
+
 def entry_from_static_row(row: Dict) -> DailysEntry:
     return {
         "stat_name": row["stat_name"],
@@ -26,157 +52,343 @@ def entry_from_static_row(row: Dict) -> DailysEntry:
     }
 
 
+def change_from_row(row: Dict) -> Change:
+    change_date = "static"
+    if row["change_date"] != "static":
+        change_date = datetime.combine(date.fromisoformat(row["change_date"]), time(0, 0, 0))
+    entry = None
+    if row["stat_data"] is not None:
+        entry = {"stat_name": row["stat_name"], "source": row["source"], "date": change_date, "data": row["stat_data"]}
+    return Change(row["seq"], row["stat_name"], change_date, entry)
+
+
+def row_date(entry_date: DailysDate) -> date:
+    if isinstance(entry_date, datetime):
+        return entry_date.date()
+    return entry_date
+
+
+# Arbitrary key, held by writers while they add to the change feed
+CHANGE_FEED_LOCK_ID = 5_144_013
+
+
 # noinspection SqlNoDataSourceInspection,PyTypeChecker
 class PostgresDataSource(DataSource):
 
     def __init__(self, db_config: Dict) -> None:
-        self.conn = psycopg2.connect(
-            host=db_config.get("host", "localhost"),
-            database=db_config.get("database", "dailys"),
-            user=db_config.get("user", "postgres"),
-            password=db_config["password"],
+        self.db_config = db_config
+        self.itersize = db_config.get("itersize", 2000)
+        self.pool = ConnectionPool(
+            self._connect,
+            min_size=db_config.get("min_connections", 1),
+            max_size=db_config.get("max_connections", 10),
+            timeout=db_config.get("pool_timeout", 30)
+        )
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        return psycopg2.connect(
+            host=self.db_config.get("host", "localhost"),
+            database=self.db_config.get("database", "dailys"),
+            user=self.db_config.get("user", "postgres"),
+            password=self.db_config["password"],
             cursor_factory=RealDictCursor
         )
 
+    @contextmanager
+    def _cursor(self, read_only: bool = True) -> Iterator[RealDictCursor]:
+        with self.pool.connection(read_only=read_only) as conn:
+            with conn.cursor() as cur:
+                yield cur
+
+    def pool_stats(self) -> PoolStats:
+        return self.pool.stats()
+
+    def migrate(self) -> List[Migration]:
+        # Schema changes get their own connection, rather than one from the pool
+        conn = self._connect()
+        try:
+            applied = migrate(conn)
+            if self.db_config.get("partitioned", False):
+                ensure_partitions(conn)
+        finally:
+            conn.close()
+        # The value counts table is created empty, so fill it in from the existing entries, as later migrations do
+        # for their own tables
+        if any(migration.version == VALUE_COUNTS_MIGRATION for migration in applied):
+            self.rebuild_value_counts()
+        return applied
+
+    def partition(self, through_year: Optional[int] = None) -> None:
+        """Moves dailys_data to the partitioned layout, or creates any partitions it is missing"""
+        conn = self._connect()
+        try:
+            ensure_partitions(conn, through_year)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _record_changes(cur: RealDictCursor, changes: List[Tuple[str, str]], deleted: bool = False) -> None:
+        """
+        Bumps the versions of changed stats, adds the changes to the change feed, and notifies listeners, as part of
+        the writing transaction. Changes are given as (stat_name, ISO date or "static") pairs.
+        """
+        if not changes:
+            return
+        # Writers take turns from here until they commit, so change feed positions are committed in order, and
+        # clients reading the feed can't miss a change which was committed after a later position
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (CHANGE_FEED_LOCK_ID,))
+        execute_values(
+            cur,
+            "INSERT INTO dailys_changes (stat_name, stat_date, deleted) VALUES %s "
+            "ON CONFLICT (stat_name, stat_date) DO UPDATE SET seq=excluded.seq, deleted=excluded.deleted",
+            [(stat_name, date_str, deleted) for stat_name, date_str in changes],
+            page_size=len(changes)
+        )
+        # Sorted, so that concurrent writes to several stats lock their version rows in the same order.
+        # The clock time is taken as the row is locked, rather than when the transaction started, and never goes
+        # backwards, so that Last-Modified only moves forward even when transactions commit out of order.
+        stat_names = sorted(set(stat_name for stat_name, _ in changes))
+        execute_values(
+            cur,
+            "INSERT INTO dailys_stat_versions (stat_name, version, updated_at) VALUES %s "
+            "ON CONFLICT (stat_name) DO UPDATE SET version=dailys_stat_versions.version + 1, "
+            "updated_at=GREATEST(dailys_stat_versions.updated_at, clock_timestamp())",
+            [(stat_name,) for stat_name in stat_names],
+            template="(%s, 1, clock_timestamp())",
+            page_size=len(stat_names)
+        )
+        # Notifications are only delivered once the transaction commits, see PostgresChangeListener
+        payloads = [(change_payload(stat_name, date_str),) for stat_name, date_str in changes]
+        execute_values(
+            cur,
+            f"SELECT pg_notify('{CHANGE_CHANNEL}', payload) FROM (VALUES %s) AS changes (payload)",
+            payloads,
+            page_size=len(payloads)
+        )
+
+    def listen_for_changes(
+            self,
+            on_change: Callable[[str, str], None],
+            on_connect: Callable[[], None]
+    ) -> PostgresChangeListener:
+        """Starts a background thread, on its own connection, which is told about writes made by any worker"""
+        listener = PostgresChangeListener(self._connect, on_change, on_connect)
+        listener.start()
+        return listener
+
+    def get_stat_version(self, stat_name: str) -> Optional[StatVersion]:
+        with self._cursor() as cur:
+            cur.execute("SELECT version, updated_at FROM dailys_stat_versions WHERE stat_name = %s", (stat_name,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return StatVersion(row["version"], row["updated_at"].astimezone(timezone.utc))
+
     def get_unique_stat_names(self) -> Set[str]:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                cur.execute(
-                    "SELECT DISTINCT stat_name FROM ("
-                        "SELECT stat_name FROM dailys_data "
-                        "UNION ALL "
-                        "SELECT stat_name FROM dailys_static"
-                    ") a"
-                )
-                return set(row["stat_name"] for row in cur.fetchall())
+        with self._cursor() as cur:
+            cur.execute(
+                "SELECT DISTINCT stat_name FROM ("
+                    "SELECT stat_name FROM dailys_data "
+                    "UNION ALL "
+                    "SELECT stat_name FROM dailys_static"
+                ") a"
+            )
+            return set(row["stat_name"] for row in cur.fetchall())
 
-    def get_entries_for_stat(self, stat_name: str) -> DailysEntries:
-        with self.conn:
-            with self.conn.cursor() as cur:
+    def get_static_entries_for_stat(self, stat_name: str) -> DailysEntries:
+        with self._cursor() as cur:
+            cur.execute(
+                "SELECT stat_name, source, stat_data FROM dailys_static WHERE stat_name = %s", (stat_name,)
+            )
+            return [entry_from_static_row(row) for row in cur.fetchall()]
+
+    def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
+        with self._cursor(read_only=False) as cur:
+            if view_date in ["earliest", "latest"]:
+                raise ValueError("Cannot delete earliest/latest stat entry")
+            if view_date == "static":
+                cur.execute("DELETE FROM dailys_static WHERE stat_name = %s", (stat_name,))
+                self._record_changes(cur, [(stat_name, "static")], deleted=True)
+            else:
                 cur.execute(
-                    "SELECT stat_name, source, stat_data FROM dailys_static WHERE stat_name = %s", (stat_name,)
+                    "DELETE FROM dailys_data WHERE stat_name = %s AND stat_date = %s",
+                    (stat_name, row_date(view_date))
                 )
-                static_rows = [entry_from_static_row(row) for row in cur.fetchall()]
                 cur.execute(
-                    "SELECT stat_name, stat_date, source, stat_data FROM dailys_data WHERE stat_name = %s",
-                    (stat_name,)
+                    "DELETE FROM dailys_value_counts WHERE stat_name = %s AND stat_date = %s",
+                    (stat_name, row_date(view_date))
                 )
-                return [entry_from_row(row) for row in cur.fetchall()] + static_rows
+                self._record_changes(cur, [(stat_name, row_date(view_date).isoformat())], deleted=True)
 
-    def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                if view_date in ["earliest", "latest"]:
-                    raise ValueError("Cannot delete earliest/latest stat entry")
-                if view_date == "static":
-                    cur.execute("DELETE FROM dailys_static WHERE stat_name = %s", (stat_name,))
-                else:
-                    cur.execute(
-                        "DELETE FROM dailys_data WHERE stat_name = %s AND stat_date = %s",
-                        (stat_name, view_date)
-                    )
-                self.conn.commit()
-
-    def get_entries_for_stat_on_date(self, stat_name: str, view_date: DailysDate) -> DailysEntries:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                if view_date == "static":
-                    cur.execute(
-                        "SELECT stat_name, source, stat_data FROM dailys_static WHERE stat_name = %s", (stat_name,)
-                    )
-                    return [entry_from_static_row(row) for row in cur.fetchall()]
-                if view_date == "earliest":
-                    cur.execute(
-                        "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                        "WHERE stat_name = %s ORDER BY stat_date ASC LIMIT 1",
-                        (stat_name,)
-                    )
-                elif view_date == "latest":
-                    cur.execute(
-                        "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                        "WHERE stat_name = %s ORDER BY stat_date DESC LIMIT 1",
-                        (stat_name,)
-                    )
-                else:
-                    cur.execute(
-                        "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                        "WHERE stat_name = %s AND stat_date = %s",
-                        (stat_name, view_date)
-                    )
-                return [entry_from_row(row) for row in cur.fetchall()]
-
-    def get_entries_over_range(self, start_date: DailysDate, end_date: DailysDate) -> DailysEntries:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                if start_date == "earliest":
-                    if end_date == "latest":
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "ORDER BY stat_date"
-                        )
-                    else:
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "WHERE stat_date <= %s "
-                            "ORDER BY stat_date",
-                            (end_date,)
-                        )
-                else:
-                    if end_date == "latest":
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "WHERE stat_date >= %s "
-                            "ORDER BY stat_date",
-                            (start_date,)
-                        )
-                    else:
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "WHERE stat_date >= %s AND stat_date <= %s "
-                            "ORDER BY stat_date",
-                            (start_date, end_date)
-                        )
-                return [entry_from_row(row) for row in cur.fetchall()]
-
-    def get_entries_for_stat_over_range(
+    def get_changes_since(self, since: int, limit: int) -> List[Change]:
+        with self._cursor() as cur:
+            # Tombstones of removed entries have no entry to join to, so come back without data
+            cur.execute(
+                "SELECT c.seq, c.stat_name, c.stat_date AS change_date, "
+                "COALESCE(d.source, s.source) AS source, COALESCE(d.stat_data, s.stat_data) AS stat_data "
+                "FROM dailys_changes c "
+                "LEFT JOIN dailys_data d ON c.stat_date <> 'static' AND d.stat_name = c.stat_name "
+                "AND d.stat_date = CASE WHEN c.stat_date = 'static' THEN NULL ELSE c.stat_date::date END "
+                "LEFT JOIN dailys_static s ON c.stat_date = 'static' AND s.stat_name = c.stat_name "
+                "WHERE c.seq > %s ORDER BY c.seq LIMIT %s",
+                (since, limit)
+            )
+            return [change_from_row(row) for row in cur.fetchall()]
+
+    @staticmethod
+    def _date_conditions(date_range: DateRange) -> Tuple[List[str], List]:
+        conditions = []
+        params = []
+        # Dates are compared as dates, not timestamps, so that the planner can prune yearly partitions
+        if date_range.start is not None:
+            conditions.append("stat_date >= %s")
+            params.append(date_range.start)
+        if date_range.end is not None:
+            conditions.append("stat_date <= %s")
+            params.append(date_range.end)
+        return conditions, params
+
+    def _select(self, query: StatQuery) -> Tuple[str, List]:
+        """Compiles the columns and conditions of a query, without its ordering or limit"""
+        columns = ["stat_name", "stat_date", "source"]
+        params = []
+        if query.fields is None:
+            columns.append("stat_data")
+        else:
+            # Fields are read as JSON text, so that a missing path (NULL) can be told apart from a JSON null
+            for index, path in enumerate(query.fields):
+                columns.append(f"(stat_data #> %s)::text AS field_{index}")
+                params.append(list(path))
+        conditions = []
+        if query.stat_names is not None:
+            if len(query.stat_names) == 1:
+                conditions.append("stat_name = %s")
+                params.append(query.stat_names[0])
+            else:
+                conditions.append("stat_name = ANY(%s)")
+                params.append(list(query.stat_names))
+        date_conditions, date_params = self._date_conditions(query.date_range)
+        conditions += date_conditions
+        params += date_params
+        for predicate in query.predicates:
+            # Containment, rather than extracting the value, so that the GIN index on stat_data can be used
+            conditions.append("stat_data @> %s::jsonb")
+            containment = {}
+            set_at_path(containment, predicate.path, predicate.value)
+            params.append(json.dumps(containment))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"SELECT {', '.join(columns)} FROM dailys_data{where}", params
+
+    def _compile(self, query: StatQuery) -> Tuple[str, List]:
+        sql, params = self._select(query)
+        direction = "DESC" if query.descending else "ASC"
+        sql += f" ORDER BY stat_date {direction}, stat_name {direction}"
+        if query.limit is not None:
+            sql += " LIMIT %s"
+            params.append(query.limit)
+        return sql, params
+
+    def get_entries_for_query(self, query: StatQuery) -> DailysEntries:
+        with self._cursor() as cur:
+            cur.execute(*self._compile(query))
+            return [entry_from_query_row(row, query) for row in cur.fetchall()]
+
+    def iter_entries_for_query(self, query: StatQuery) -> Iterator[DailysEntry]:
+        sql, params = self._compile(query)
+        # Named cursors are server-side, so rows are fetched in batches of itersize, rather than all at once.
+        # They need a transaction to live in, so this can't use an autocommit connection.
+        with self.pool.connection(read_only=True, autocommit=False) as conn:
+            with conn.cursor(name="dailys_iter", cursor_factory=RealDictCursor) as cur:
+                cur.itersize = self.itersize
+                cur.execute(sql, params)
+                for row in cur:
+                    yield entry_from_query_row(row, query)
+
+    def get_entries_for_stats_over_range(
             self,
-            stat_name: str,
-            start_date: DailysDate,
-            end_date: DailysDate
-    ) -> DailysEntries:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                if start_date == "earliest":
-                    if end_date == "latest":
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "WHERE stat_name = %s "
-                            "ORDER BY stat_date",
-                            (stat_name,)
-                        )
-                    else:
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "WHERE stat_name = %s AND stat_date <= %s "
-                            "ORDER BY stat_date",
-                            (stat_name, end_date)
-                        )
-                else:
-                    if end_date == "latest":
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "WHERE stat_name = %s AND stat_date >= %s "
-                            "ORDER BY stat_date",
-                            (stat_name, start_date)
-                        )
-                    else:
-                        cur.execute(
-                            "SELECT stat_name, stat_date, source, stat_data FROM dailys_data "
-                            "WHERE stat_name = %s AND stat_date >= %s AND stat_date <= %s "
-                            "ORDER BY stat_date",
-                            (stat_name, start_date, end_date)
-                        )
-                return [entry_from_row(row) for row in cur.fetchall()]
+            stat_ranges: StatRanges,
+            include_static: Iterable[str] = ()
+    ) -> StatsEntries:
+        # Stats sharing a date range share a subquery, and static entries come back with a null date
+        selects = []
+        params = []
+        for query in queries_for_stat_ranges(stat_ranges):
+            select_sql, select_params = self._select(query)
+            selects.append(select_sql)
+            params += select_params
+        include_static = list(include_static)
+        if include_static:
+            selects.append(
+                "SELECT stat_name, NULL::date AS stat_date, source, stat_data FROM dailys_static "
+                "WHERE stat_name = ANY(%s)"
+            )
+            params.append(include_static)
+        if not selects:
+            return StatsEntries({}, {})
+        with self._cursor() as cur:
+            cur.execute(f"{' UNION ALL '.join(selects)} ORDER BY stat_date", params)
+            entries = (
+                entry_from_static_row(row) if row["stat_date"] is None else entry_from_row(row)
+                for row in cur.fetchall()
+            )
+            return group_by_stat(entries, stat_ranges.keys())
+
+    def get_value_counts_over_range(self, start_date: DailysDate, end_date: DailysDate) -> List[ValueCount]:
+        # Read from the summary table, which is kept up to date on every write, see _write_value_counts()
+        conditions, params = self._date_conditions(DateRange.between(start_date, end_date))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        with self._cursor() as cur:
+            cur.execute(
+                f"SELECT stat_date, stat_name, source, \"values\" FROM dailys_value_counts {where}"
+                "ORDER BY stat_date, stat_name",
+                params
+            )
+            return [
+                ValueCount(row["stat_name"], row["stat_date"], row["source"], 1, row["values"])
+                for row in cur.fetchall()
+            ]
+
+    @staticmethod
+    def _value_count_row(stat_name: str, stat_date: date, source: str, data: DailysData) -> Tuple:
+        entry = {
+            "stat_name": stat_name,
+            "date": datetime.combine(stat_date, time(0, 0, 0)),
+            "source": source,
+            "data": data
+        }
+        return stat_name, stat_date, source, stored_value_count(entry)
+
+    @staticmethod
+    def _write_value_counts(cur: RealDictCursor, value_count_rows: List[Tuple]) -> None:
+        execute_values(
+            cur,
+            "INSERT INTO dailys_value_counts (stat_name, stat_date, source, \"values\") VALUES %s "
+            "ON CONFLICT (stat_name, stat_date) "
+            "DO UPDATE SET source=excluded.source, \"values\"=excluded.\"values\"",
+            value_count_rows,
+            page_size=len(value_count_rows)
+        )
+
+    def rebuild_value_counts(self, progress: Optional[BulkProgressCallback] = None) -> int:
+        """Recalculates the whole value counts summary table from dailys_data, in one transaction"""
+        start_time = perf_counter()
+        total = 0
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM dailys_value_counts")
+                with conn.cursor(name="dailys_rebuild", cursor_factory=RealDictCursor) as read_cur:
+                    read_cur.itersize = self.itersize
+                    read_cur.execute("SELECT stat_name, stat_date, source, stat_data FROM dailys_data")
+                    rows = (
+                        self._value_count_row(row["stat_name"], row["stat_date"], row["source"], row["stat_data"])
+                        for row in read_cur
+                    )
+                    for batch_number, batch in enumerate(batched(rows, self.itersize), start=1):
+                        self._write_value_counts(cur, batch)
+                        total += len(batch)
+                        if progress is not None:
+                            progress(BulkProgress(batch_number, len(batch), total, perf_counter() - start_time))
+        return total
 
     def update_entry_for_stat_on_date(
             self,
@@ -185,32 +397,80 @@ class PostgresDataSource(DataSource):
             new_data: DailysData,
             source: str
     ) -> DailysEntry:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                if update_date in ["earliest", "latest"]:
-                    raise ValueError("Can't update data on earliest/latest")
-                if update_date == "static":
-                    cur.execute(
-                        "INSERT INTO dailys_static (stat_name, source, stat_data) VALUES (%s, %s, %s) "
-                        "ON CONFLICT (stat_name) DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
-                        (stat_name, source, json.dumps(new_data))
-                    )
-                    self.conn.commit()
-                    return
+        with self._cursor(read_only=False) as cur:
+            if update_date in ["earliest", "latest"]:
+                raise ValueError("Can't update data on earliest/latest")
+            if update_date == "static":
                 cur.execute(
-                    "INSERT INTO dailys_data (stat_name, stat_date, source, stat_data) VALUES (%s, %s, %s, %s) "
-                    "ON CONFLICT (stat_name, stat_date) "
-                    "DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
-                    (stat_name, update_date, source, json.dumps(new_data))
+                    "INSERT INTO dailys_static (stat_name, source, stat_data) VALUES (%s, %s, %s) "
+                    "ON CONFLICT (stat_name) DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
+                    (stat_name, source, json.dumps(new_data))
                 )
-                self.conn.commit()
+                self._record_changes(cur, [(stat_name, "static")])
+                return
+            cur.execute(
+                "INSERT INTO dailys_data (stat_name, stat_date, source, stat_data) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (stat_name, stat_date) "
+                "DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
+                (stat_name, update_date, source, json.dumps(new_data))
+            )
+            self._write_value_counts(cur, [self._value_count_row(stat_name, row_date(update_date), source, new_data)])
+            self._record_changes(cur, [(stat_name, row_date(update_date).isoformat())])
 
-    def get_latest_n_entries_for_stat(self, stat_name: str, n: int) -> DailysEntries:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                cur.execute(
-                    "SELECT stat_name, stat_date, source, stat_data"
-                    " FROM dailys_data WHERE stat_name = %s ORDER BY stat_date DESC LIMIT %s",
-                    (stat_name, n)
+    def update_entries_bulk(
+            self,
+            entries: Iterable[DailysEntry],
+            batch_size: int = 1000,
+            progress: Optional[BulkProgressCallback] = None
+    ) -> int:
+        start_time = perf_counter()
+        total = 0
+        for batch_number, batch in enumerate(batched(entries, batch_size), start=1):
+            # Rows are keyed so that a repeated entry within a batch overwrites the earlier one, as postgres won't
+            # let one INSERT ... ON CONFLICT statement update the same row twice.
+            data_rows = {}
+            static_rows = {}
+            for entry in batch:
+                stat_name = entry["stat_name"]
+                entry_date = entry["date"]
+                if entry_date in ["earliest", "latest"]:
+                    raise CantUpdate("Can't update data on earliest/latest")
+                if entry_date == "static":
+                    static_rows[stat_name] = (stat_name, entry["source"], json.dumps(entry["data"]))
+                else:
+                    stat_date = row_date(entry_date)
+                    data_rows[(stat_name, stat_date)] = (stat_name, stat_date, entry["source"], entry["data"])
+            with self._cursor(read_only=False) as cur:
+                if data_rows:
+                    execute_values(
+                        cur,
+                        "INSERT INTO dailys_data (stat_name, stat_date, source, stat_data) VALUES %s "
+                        "ON CONFLICT (stat_name, stat_date) "
+                        "DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
+                        [
+                            (stat_name, stat_date, source, json.dumps(entry_data))
+                            for (stat_name, stat_date, source, entry_data) in data_rows.values()
+                        ],
+                        page_size=len(data_rows)
+                    )
+                    self._write_value_counts(cur, [
+                        self._value_count_row(stat_name, stat_date, source, entry_data)
+                        for (stat_name, stat_date, source, entry_data) in data_rows.values()
+                    ])
+                if static_rows:
+                    execute_values(
+                        cur,
+                        "INSERT INTO dailys_static (stat_name, source, stat_data) VALUES %s "
+                        "ON CONFLICT (stat_name) DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
+                        list(static_rows.values()),
+                        page_size=len(static_rows)
+                    )
+                self._record_changes(
+                    cur,
+                    [(stat_name, stat_date.isoformat()) for (stat_name, stat_date) in data_rows.keys()]
+                    + [(stat_name, "static") for stat_name in static_rows.keys()]
                 )
-                return [entry_from_row(row) for row in cur.fetchall()]
\ No newline at end of file
+            total += len(batch)
+            if progress is not None:
+                progress(BulkProgress(batch_number, len(batch), total, perf_counter() - start_time))
+        return total
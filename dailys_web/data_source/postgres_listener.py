@@ -0,0 +1,74 @@
+import logging
+import select
+import threading
+from typing import Callable
+
+import psycopg2
+from psycopg2.extensions import connection
+
+logger = logging.getLogger(__name__)
+
+CHANGE_CHANNEL = "dailys_changed"
+
+
+def change_payload(stat_name: str, date_str: str) -> str:
+    return f"{stat_name}:{date_str}"
+
+
+class PostgresChangeListener(threading.Thread):
+    """
+    Background thread which LISTENs for change notifications sent by other workers' writes.
+    Calls on_change(stat_name, date_str) for each notification, where date_str is an ISO date or "static".
+    Calls on_connect() each time it (re)connects, as notifications sent while disconnected are lost.
+    """
+
+    def __init__(
+            self,
+            connect: Callable[[], connection],
+            on_change: Callable[[str, str], None],
+            on_connect: Callable[[], None],
+            poll_timeout: float = 5,
+            retry_delay: float = 5
+    ) -> None:
+        super().__init__(name="dailys-change-listener", daemon=True)
+        self.connect = connect
+        self.on_change = on_change
+        self.on_connect = on_connect
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+            except psycopg2.Error:
+                logger.exception("Change listener lost its database connection, retrying in %ss", self.retry_delay)
+                self._stopped.wait(self.retry_delay)
+            except Exception:
+                # Any error must not end the thread, or this worker's caches would silently stop being invalidated.
+                # Reconnecting calls on_connect again, which covers any changes missed.
+                logger.exception("Change listener failed, reconnecting in %ss", self.retry_delay)
+                self._stopped.wait(self.retry_delay)
+
+    def _listen(self) -> None:
+        conn = self.connect()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CHANGE_CHANNEL}")
+            self.on_connect()
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([conn], [], [], self.poll_timeout)
+                if not readable:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    stat_name, _, date_str = notify.payload.rpartition(":")
+                    self.on_change(stat_name, date_str)
+        finally:
+            conn.close()
@@ -0,0 +1,134 @@
+"""
+Versioned schema for the postgres data source.
+Apply pending migrations with: python -m dailys_web.data_source.postgres_migrations
+"""
+import json
+from typing import List, NamedTuple
+
+from psycopg2.extensions import connection, cursor
+
+# Arbitrary key, so that workers starting up together don't apply the same migration twice
+MIGRATION_LOCK_ID = 5_144_012
+# The migration creating dailys_value_counts, which is filled in by PostgresDataSource.rebuild_value_counts()
+VALUE_COUNTS_MIGRATION = 2
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: List[str]
+
+
+MIGRATIONS = [
+    Migration(1, "Create entry tables", [
+        # Existing deployments created these from the old db_schema.sql, so everything here must be idempotent
+        'CREATE TABLE IF NOT EXISTS dailys_data ('
+        '"stat_name" text NOT NULL, '
+        '"stat_date" date NOT NULL, '
+        '"source" text NOT NULL, '
+        '"stat_data" jsonb NOT NULL, '
+        'CONSTRAINT "dailys_data_stat_name_stat_date" UNIQUE ("stat_name", "stat_date")'
+        ')',
+        # The composite (stat_name, stat_date) btree behind ON CONFLICT, stat_name filters, and ORDER BY stat_date,
+        # which is scanned backwards for ORDER BY stat_date DESC LIMIT n.
+        # It's normally the unique constraint's own index, this only creates it if that constraint was never added.
+        'CREATE UNIQUE INDEX IF NOT EXISTS "dailys_data_stat_name_stat_date" '
+        'ON dailys_data ("stat_name", "stat_date")',
+        'CREATE TABLE IF NOT EXISTS dailys_static ('
+        '"stat_name" text UNIQUE NOT NULL, '
+        '"source" text NOT NULL, '
+        '"stat_data" jsonb NOT NULL'
+        ')',
+    ]),
+    Migration(2, "Create value counts summary table", [
+        'CREATE TABLE IF NOT EXISTS dailys_value_counts ('
+        '"stat_name" text NOT NULL, '
+        '"stat_date" date NOT NULL, '
+        '"source" text NOT NULL, '
+        '"values" integer NOT NULL, '
+        'PRIMARY KEY ("stat_name", "stat_date")'
+        ')',
+    ]),
+    Migration(3, "Add range scan and JSON indexes", [
+        # Full-history scans across every stat read in stat_date order, which BRIN handles cheaply as dates are
+        # mostly inserted in order.
+        'CREATE INDEX IF NOT EXISTS "dailys_data_stat_date_brin" ON dailys_data USING BRIN ("stat_date")',
+        'CREATE INDEX IF NOT EXISTS "dailys_data_stat_data_gin" ON dailys_data USING GIN ("stat_data" jsonb_path_ops)',
+        # Covering index, so the stats page's range reads of the summary table are index-only scans
+        'DROP INDEX IF EXISTS "dailys_value_counts_stat_date"',
+        'CREATE INDEX IF NOT EXISTS "dailys_value_counts_stat_date_covering" '
+        'ON dailys_value_counts ("stat_date", "stat_name") INCLUDE ("source", "values")',
+    ]),
+    Migration(4, "Track stat versions", [
+        # One row per stat, bumped by every write, so conditional requests can be answered without reading entries
+        'CREATE TABLE IF NOT EXISTS dailys_stat_versions ('
+        '"stat_name" text PRIMARY KEY, '
+        '"version" bigint NOT NULL, '
+        '"updated_at" timestamptz NOT NULL DEFAULT now()'
+        ')',
+        'INSERT INTO dailys_stat_versions (stat_name, version) '
+        'SELECT stat_name, 1 FROM dailys_data GROUP BY stat_name '
+        'UNION '
+        'SELECT stat_name, 1 FROM dailys_static '
+        'ON CONFLICT (stat_name) DO NOTHING',
+    ]),
+    Migration(5, "Add change feed", [
+        # One row per entry, live or removed, keyed by the date as written in change notifications, or "static".
+        # Each write gives the entry's row the next sequence number, so the feed only grows with the number of entries.
+        'CREATE SEQUENCE IF NOT EXISTS dailys_changes_seq',
+        'CREATE TABLE IF NOT EXISTS dailys_changes ('
+        '"stat_name" text NOT NULL, '
+        '"stat_date" text NOT NULL, '
+        "\"seq\" bigint NOT NULL DEFAULT nextval('dailys_changes_seq'), "
+        '"deleted" boolean NOT NULL, '
+        'PRIMARY KEY ("stat_name", "stat_date")'
+        ')',
+        'CREATE UNIQUE INDEX IF NOT EXISTS "dailys_changes_seq_index" ON dailys_changes ("seq")',
+        # Existing entries go in the feed in date order, so that syncing from the start of the feed gets everything
+        'INSERT INTO dailys_changes (stat_name, stat_date, deleted) '
+        'SELECT stat_name, stat_date::text, false FROM dailys_data ORDER BY stat_date, stat_name '
+        'ON CONFLICT (stat_name, stat_date) DO NOTHING',
+        'INSERT INTO dailys_changes (stat_name, stat_date, deleted) '
+        "SELECT stat_name, 'static', false FROM dailys_static ORDER BY stat_name "
+        'ON CONFLICT (stat_name, stat_date) DO NOTHING',
+    ]),
+]
+
+
+def applied_versions(conn: connection) -> List[int]:
+    with conn.cursor(cursor_factory=cursor) as cur:
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS dailys_schema_version ("
+            "version integer PRIMARY KEY, "
+            "description text NOT NULL, "
+            "applied_at timestamptz NOT NULL DEFAULT now()"
+            ")"
+        )
+        cur.execute("SELECT version FROM dailys_schema_version ORDER BY version")
+        return [row[0] for row in cur.fetchall()]
+
+
+def migrate(conn: connection) -> List[Migration]:
+    """Applies any pending migrations, in order, in a single transaction. Returns the migrations applied."""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        done = set(applied_versions(conn))
+        pending = [migration for migration in MIGRATIONS if migration.version not in done]
+        with conn.cursor() as cur:
+            for migration in pending:
+                for statement in migration.statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO dailys_schema_version (version, description) VALUES (%s, %s)",
+                    (migration.version, migration.description)
+                )
+    return pending
+
+
+if __name__ == "__main__":
+    from dailys_web.data_source.postgres import PostgresDataSource
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    for applied in PostgresDataSource(config["database"]).migrate():
+        print(f"Applied migration {applied.version}: {applied.description}")
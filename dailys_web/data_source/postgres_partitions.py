@@ -0,0 +1,147 @@
+"""
+Optional partitioned layout for dailys_data: list partitions by stat_name, each sub-partitioned by year of stat_date.
+Enabled with "partitioned": true in the database config, and applied with the migrations at startup, or with:
+python -m dailys_web.data_source.postgres_partitions
+"""
+import hashlib
+import json
+import re
+from datetime import date
+from typing import Dict, Set, Optional
+
+from psycopg2 import sql
+from psycopg2.extensions import connection, cursor
+
+from dailys_web.data_source.postgres_migrations import MIGRATION_LOCK_ID
+
+DEFAULT_PARTITION = "dailys_data_default"
+# Postgres truncates identifiers longer than this
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def stat_partition_name(stat_name: str) -> str:
+    # Stat names can be any text, so the table name is a cleaned up prefix of it, with a hash to keep it unique
+    stat_hash = hashlib.sha1(stat_name.encode()).hexdigest()[:8]
+    cleaned = re.sub(r"[^a-z0-9]+", "_", stat_name.lower()).strip("_")
+    # Leaves room for the "_yyyy" and "_default" suffixes of the yearly partitions
+    prefix = f"dailys_data_{cleaned}"[:MAX_IDENTIFIER_LENGTH - len(stat_hash) - len("__default")]
+    return f"{prefix}_{stat_hash}"
+
+
+def is_partitioned(conn: connection) -> bool:
+    with conn.cursor(cursor_factory=cursor) as cur:
+        cur.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('dailys_data'))"
+        )
+        return cur.fetchone()[0]
+
+
+def _stat_years(cur: cursor, table: str, through_year: int) -> Dict[str, Set[int]]:
+    """Returns the years which need partitions for each stat with rows in the given table"""
+    cur.execute(sql.SQL(
+        "SELECT stat_name, MIN(EXTRACT(YEAR FROM stat_date))::int, MAX(EXTRACT(YEAR FROM stat_date))::int "
+        "FROM {} GROUP BY stat_name"
+    ).format(sql.Identifier(table)))
+    return {
+        stat_name: set(range(min_year, max(max_year, through_year) + 1))
+        for stat_name, min_year, max_year in cur.fetchall()
+    }
+
+
+def _create_partitions(cur: cursor, parent: str, stat_years: Dict[str, Set[int]]) -> None:
+    for stat_name, years in stat_years.items():
+        stat_table = stat_partition_name(stat_name)
+        cur.execute(sql.SQL(
+            "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({}) PARTITION BY RANGE (stat_date)"
+        ).format(sql.Identifier(stat_table), sql.Identifier(parent), sql.Literal(stat_name)))
+        cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT").format(
+            sql.Identifier(f"{stat_table}_default"), sql.Identifier(stat_table)
+        ))
+        for year in sorted(years):
+            cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(
+                sql.Identifier(f"{stat_table}_{year}"),
+                sql.Identifier(stat_table),
+                sql.Literal(date(year, 1, 1)),
+                sql.Literal(date(year + 1, 1, 1))
+            ))
+
+
+def _convert_to_partitioned(cur: cursor, through_year: int) -> None:
+    cur.execute("LOCK TABLE dailys_data IN ACCESS EXCLUSIVE MODE")
+    # Index definitions are copied over, so that this doesn't need updating whenever a migration adds an index.
+    # The unique constraint's own index is recreated along with the constraint.
+    cur.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'dailys_data' "
+        "AND indexname NOT IN ("
+        "SELECT conname FROM pg_constraint WHERE conrelid = 'dailys_data'::regclass AND contype IN ('u', 'p')"
+        ")"
+    )
+    index_defs = [index_def for _, index_def in cur.fetchall()]
+    cur.execute(
+        "CREATE TABLE dailys_data_partitioned (LIKE dailys_data INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        "PARTITION BY LIST (stat_name)"
+    )
+    cur.execute(
+        "ALTER TABLE dailys_data_partitioned "
+        "ADD CONSTRAINT dailys_data_partitioned_key UNIQUE (stat_name, stat_date)"
+    )
+    cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF dailys_data_partitioned DEFAULT").format(
+        sql.Identifier(DEFAULT_PARTITION)
+    ))
+    _create_partitions(cur, "dailys_data_partitioned", _stat_years(cur, "dailys_data", through_year))
+    cur.execute("INSERT INTO dailys_data_partitioned SELECT * FROM dailys_data")
+    cur.execute("DROP TABLE dailys_data")
+    cur.execute("ALTER TABLE dailys_data_partitioned RENAME TO dailys_data")
+    cur.execute(
+        "ALTER TABLE dailys_data RENAME CONSTRAINT dailys_data_partitioned_key TO \"dailys_data_stat_name_stat_date\""
+    )
+    for index_def in index_defs:
+        cur.execute(index_def)
+
+
+def _split_default_partitions(cur: cursor, through_year: int) -> None:
+    # Rows for new stats, or for years without a partition yet, land in a default partition. Postgres won't create a
+    # partition which would own rows already sitting in a default partition, so those rows are moved out first.
+    cur.execute("CREATE TEMPORARY TABLE dailys_data_moving (LIKE dailys_data) ON COMMIT DROP")
+    cur.execute(
+        "SELECT tree.relid::regclass::text FROM pg_partition_tree('dailys_data') tree "
+        "JOIN pg_class ON pg_class.oid = tree.relid "
+        "WHERE tree.isleaf AND pg_get_expr(pg_class.relpartbound, pg_class.oid) = 'DEFAULT'"
+    )
+    for (default_partition,) in cur.fetchall():
+        cur.execute(sql.SQL(
+            "WITH moved AS (DELETE FROM {} RETURNING *) INSERT INTO dailys_data_moving SELECT * FROM moved"
+        ).format(sql.SQL(default_partition)))
+    stat_years = _stat_years(cur, "dailys_data", through_year)
+    for stat_name, years in _stat_years(cur, "dailys_data_moving", through_year).items():
+        stat_years.setdefault(stat_name, set()).update(years)
+    _create_partitions(cur, "dailys_data", stat_years)
+    cur.execute("INSERT INTO dailys_data SELECT * FROM dailys_data_moving")
+
+
+def ensure_partitions(conn: connection, through_year: Optional[int] = None) -> None:
+    """
+    Converts dailys_data to the partitioned layout if it isn't already, and creates partitions for every stat, for
+    each year up to through_year (next year, by default), moving over any rows stored in the default partitions.
+    """
+    if through_year is None:
+        through_year = date.today().year + 1
+    with conn:
+        with conn.cursor(cursor_factory=cursor) as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        partitioned = is_partitioned(conn)
+        with conn.cursor(cursor_factory=cursor) as cur:
+            if partitioned:
+                _split_default_partitions(cur, through_year)
+            else:
+                _convert_to_partitioned(cur, through_year)
+
+
+if __name__ == "__main__":
+    from dailys_web.data_source.postgres import PostgresDataSource
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    database = PostgresDataSource(config["database"])
+    database.migrate()
+    database.partition()
+    print("dailys_data partitions are up to date")
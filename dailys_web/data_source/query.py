@@ -0,0 +1,35 @@
+from typing import Iterable, List
+
+from dailys_web.data_source.data_source import DailysEntry, StatQuery, to_date, StatRanges, DateRange, StatsEntries, \
+    json_equals
+from dailys_web.data_source.json_paths import value_at_path
+
+
+def matches(entry: DailysEntry, query: StatQuery) -> bool:
+    """Checks a dated entry against the query's stat names, date range, and predicates, in python"""
+    if query.stat_names is not None and entry["stat_name"] not in query.stat_names:
+        return False
+    if not query.date_range.contains(to_date(entry["date"])):
+        return False
+    return all(
+        json_equals(value_at_path(entry["data"], predicate.path), predicate.value) for predicate in query.predicates
+    )
+
+
+def queries_for_stat_ranges(stat_ranges: StatRanges) -> List[StatQuery]:
+    """Builds one query for each distinct date range, covering every stat requested over that range"""
+    stats_by_range = {}
+    for stat_name, (start_date, end_date) in stat_ranges.items():
+        stats_by_range.setdefault(DateRange.between(start_date, end_date), []).append(stat_name)
+    return [StatQuery(tuple(stat_names), date_range) for date_range, stat_names in stats_by_range.items()]
+
+
+def group_by_stat(entries: Iterable[DailysEntry], stat_names: Iterable[str]) -> StatsEntries:
+    """Groups date ordered entries, including any static entries, by stat name"""
+    grouped = StatsEntries({stat_name: [] for stat_name in stat_names}, {})
+    for entry in entries:
+        if entry["date"] == "static":
+            grouped.static[entry["stat_name"]] = entry
+        else:
+            grouped.entries[entry["stat_name"]].append(entry)
+    return grouped
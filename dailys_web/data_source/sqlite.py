@@ -0,0 +1,440 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, date, timezone
+from time import perf_counter
+from typing import Dict, Set, List, Iterator, Optional, Tuple, Iterable
+
+from dailys_models.value_counts import stored_value_count
+from dailys_web.data_source.data_source import DailysEntry, DataSource, DailysEntries, DailysDate, DailysData, \
+    BulkProgressCallback, batched, CantUpdate, BulkProgress, ValueCount, StatQuery, DateRange, StatRanges, \
+    StatsEntries, StatVersion, Change
+from dailys_web.data_source.json_paths import set_at_path, FieldPath
+from dailys_web.data_source.query import queries_for_stat_ranges, group_by_stat
+
+SCHEMA = [
+    # Dates are stored as ISO strings, which sort in date order.
+    # WITHOUT ROWID stores rows in primary key order, so a stat's entries are read in date order from one btree.
+    'CREATE TABLE IF NOT EXISTS dailys_data ('
+    'stat_name TEXT NOT NULL, '
+    'stat_date TEXT NOT NULL, '
+    'source TEXT NOT NULL, '
+    'stat_data TEXT NOT NULL CHECK (json_valid(stat_data)), '
+    'PRIMARY KEY (stat_name, stat_date)'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS dailys_data_stat_date ON dailys_data (stat_date)',
+    'CREATE TABLE IF NOT EXISTS dailys_static ('
+    'stat_name TEXT PRIMARY KEY, '
+    'source TEXT NOT NULL, '
+    'stat_data TEXT NOT NULL CHECK (json_valid(stat_data))'
+    ') WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS dailys_value_counts ('
+    'stat_name TEXT NOT NULL, '
+    'stat_date TEXT NOT NULL, '
+    'source TEXT NOT NULL, '
+    '"values" INTEGER NOT NULL, '
+    'PRIMARY KEY (stat_name, stat_date)'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS dailys_value_counts_stat_date ON dailys_value_counts (stat_date)',
+    # Bumped by every write to a stat, with updated_at as an ISO datetime in UTC
+    'CREATE TABLE IF NOT EXISTS dailys_stat_versions ('
+    'stat_name TEXT PRIMARY KEY, '
+    'version INTEGER NOT NULL, '
+    'updated_at TEXT NOT NULL'
+    ') WITHOUT ROWID',
+    # The change feed, with one row per entry, live or removed, keyed by ISO date or "static".
+    # Each write gives the entry's row the next sequence number.
+    'CREATE TABLE IF NOT EXISTS dailys_changes ('
+    'stat_name TEXT NOT NULL, '
+    'stat_date TEXT NOT NULL, '
+    'seq INTEGER NOT NULL, '
+    'deleted INTEGER NOT NULL, '
+    'PRIMARY KEY (stat_name, stat_date)'
+    ') WITHOUT ROWID',
+    'CREATE UNIQUE INDEX IF NOT EXISTS dailys_changes_seq ON dailys_changes (seq)',
+    # Databases created before the change feed start it with their existing entries, in date order, static last
+    'INSERT INTO dailys_changes (stat_name, stat_date, seq, deleted) '
+    'SELECT stat_name, stat_date, ROW_NUMBER() OVER (ORDER BY stat_date, stat_name), 0 FROM ('
+    'SELECT stat_name, stat_date FROM dailys_data '
+    'UNION ALL '
+    "SELECT stat_name, 'static' AS stat_date FROM dailys_static"
+    ') WHERE NOT EXISTS (SELECT 1 FROM dailys_changes)',
+]
+
+
+def row_date(entry_date: DailysDate) -> str:
+    if isinstance(entry_date, datetime):
+        return entry_date.date().isoformat()
+    return entry_date.isoformat()
+
+
+def json_path(path: FieldPath) -> str:
+    # Quoted keys can't escape quotes, so rather than build a broken path which silently matches nothing, refuse it
+    if any('"' in key for key in path):
+        raise ValueError(f"SQLite JSON paths can't contain double quotes: {path}")
+    return "$" + "".join(f'."{key}"' for key in path)
+
+
+def entry_from_row(row: sqlite3.Row) -> DailysEntry:
+    return {
+        "stat_name": row["stat_name"],
+        "source": row["source"],
+        "date": datetime.combine(date.fromisoformat(row["stat_date"]), time(0, 0, 0)),
+        "data": json.loads(row["stat_data"])
+    }
+
+
+def entry_from_query_row(row: sqlite3.Row, query: StatQuery) -> DailysEntry:
+    if query.fields is None:
+        return entry_from_row(row)
+    data = {}
+    for index, path in enumerate(query.fields):
+        if row[f"field_{index}"] is not None:
+            set_at_path(data, path, json.loads(row[f"field_{index}"]))
+    return {
+        "stat_name": row["stat_name"],
+        "source": row["source"],
+        "date": datetime.combine(date.fromisoformat(row["stat_date"]), time(0, 0, 0)),
+        "data": data
+    }
+
+
+def change_from_row(row: sqlite3.Row) -> Change:
+    change_date = "static"
+    if row["change_date"] != "static":
+        change_date = datetime.combine(date.fromisoformat(row["change_date"]), time(0, 0, 0))
+    entry = None
+    if row["stat_data"] is not None:
+        entry = {
+            "stat_name": row["stat_name"],
+            "source": row["source"],
+            "date": change_date,
+            "data": json.loads(row["stat_data"])
+        }
+    return Change(row["seq"], row["stat_name"], change_date, entry)
+
+
+def entry_from_static_row(row: sqlite3.Row) -> DailysEntry:
+    return {
+        "stat_name": row["stat_name"],
+        "source": row["source"],
+        "date": "static",
+        "data": json.loads(row["stat_data"])
+    }
+
+
+# noinspection SqlNoDataSourceInspection
+class SqliteDataSource(DataSource):
+    """
+    Stores entries in a local SQLite database file, for single node installs which don't want to run a database server.
+    Each thread gets its own connection, and the database runs in WAL mode, so readers don't block the writer.
+    """
+
+    def __init__(self, db_config: Dict) -> None:
+        self.path = db_config.get("path", "dailys.sqlite3")
+        self.busy_timeout = db_config.get("busy_timeout", 30)
+        self.itersize = db_config.get("itersize", 2000)
+        self._local = threading.local()
+        with self._connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly in _connection(), rather than by the sqlite3 module
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, this only risks the latest transactions on power loss, never corruption
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self, read_only: bool = False) -> Iterator[sqlite3.Connection]:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        if read_only or conn.in_transaction:
+            yield conn
+            return
+        # Take the write lock up front, rather than failing to upgrade a read lock part way through
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_unique_stat_names(self) -> Set[str]:
+        with self._connection(read_only=True) as conn:
+            rows = conn.execute(
+                "SELECT stat_name FROM dailys_data GROUP BY stat_name "
+                "UNION "
+                "SELECT stat_name FROM dailys_static"
+            ).fetchall()
+            return set(row["stat_name"] for row in rows)
+
+    def get_static_entries_for_stat(self, stat_name: str) -> DailysEntries:
+        with self._connection(read_only=True) as conn:
+            rows = conn.execute(
+                "SELECT stat_name, source, stat_data FROM dailys_static WHERE stat_name = ?", (stat_name,)
+            ).fetchall()
+            return [entry_from_static_row(row) for row in rows]
+
+    def remove_stat_on_date(self, stat_name: str, view_date: DailysDate) -> None:
+        if view_date in ["earliest", "latest"]:
+            raise ValueError("Cannot delete earliest/latest stat entry")
+        with self._connection() as conn:
+            if view_date == "static":
+                conn.execute("DELETE FROM dailys_static WHERE stat_name = ?", (stat_name,))
+                self._record_changes(conn, [(stat_name, "static")], deleted=True)
+                return
+            params = (stat_name, row_date(view_date))
+            self._record_changes(conn, [params], deleted=True)
+            conn.execute("DELETE FROM dailys_data WHERE stat_name = ? AND stat_date = ?", params)
+            conn.execute("DELETE FROM dailys_value_counts WHERE stat_name = ? AND stat_date = ?", params)
+
+    def get_stat_version(self, stat_name: str) -> Optional[StatVersion]:
+        with self._connection(read_only=True) as conn:
+            row = conn.execute(
+                "SELECT version, updated_at FROM dailys_stat_versions WHERE stat_name = ?", (stat_name,)
+            ).fetchone()
+            if row is None:
+                return None
+            return StatVersion(row["version"], datetime.fromisoformat(row["updated_at"]))
+
+    def get_changes_since(self, since: int, limit: int) -> List[Change]:
+        with self._connection(read_only=True) as conn:
+            # Tombstones of removed entries have no entry to join to, so come back without data
+            rows = conn.execute(
+                "SELECT c.seq, c.stat_name, c.stat_date AS change_date, "
+                "COALESCE(d.source, s.source) AS source, COALESCE(d.stat_data, s.stat_data) AS stat_data "
+                "FROM dailys_changes c "
+                "LEFT JOIN dailys_data d ON d.stat_name = c.stat_name AND d.stat_date = c.stat_date "
+                "LEFT JOIN dailys_static s ON c.stat_date = 'static' AND s.stat_name = c.stat_name "
+                "WHERE c.seq > ? ORDER BY c.seq LIMIT ?",
+                (since, limit)
+            ).fetchall()
+            return [change_from_row(row) for row in rows]
+
+    @staticmethod
+    def _record_changes(conn: sqlite3.Connection, changes: List[Tuple[str, str]], deleted: bool = False) -> None:
+        """
+        Bumps the versions of changed stats, and adds the changes to the change feed, as part of the writing
+        transaction. Changes are given as (stat_name, ISO date or "static") pairs.
+        """
+        updated_at = datetime.now(timezone.utc).isoformat()
+        conn.executemany(
+            "INSERT INTO dailys_stat_versions (stat_name, version, updated_at) VALUES (?, 1, ?) "
+            "ON CONFLICT (stat_name) DO UPDATE SET version=version + 1, updated_at=excluded.updated_at",
+            [(stat_name, updated_at) for stat_name in set(stat_name for stat_name, _ in changes)]
+        )
+        # Writes hold the database's write lock, so sequence numbers are committed in order
+        conn.executemany(
+            "INSERT INTO dailys_changes (stat_name, stat_date, seq, deleted) "
+            "VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM dailys_changes), ?) "
+            "ON CONFLICT (stat_name, stat_date) DO UPDATE SET seq=excluded.seq, deleted=excluded.deleted",
+            [(stat_name, date_str, deleted) for stat_name, date_str in changes]
+        )
+
+    @staticmethod
+    def _date_conditions(date_range: DateRange) -> Tuple[List[str], List]:
+        conditions = []
+        params = []
+        if date_range.start is not None:
+            conditions.append("stat_date >= ?")
+            params.append(date_range.start.isoformat())
+        if date_range.end is not None:
+            conditions.append("stat_date <= ?")
+            params.append(date_range.end.isoformat())
+        return conditions, params
+
+    @staticmethod
+    def _select(query: StatQuery) -> Tuple[str, List]:
+        """Compiles the columns and conditions of a query, without its ordering or limit"""
+        columns = ["stat_name", "stat_date", "source"]
+        params = []
+        if query.fields is None:
+            columns.append("stat_data")
+        else:
+            # The -> operator returns JSON text, so a missing path (NULL) can be told apart from a JSON null
+            for index, path in enumerate(query.fields):
+                columns.append(f"stat_data -> ? AS field_{index}")
+                params.append(json_path(path))
+        conditions = []
+        if query.stat_names is not None:
+            conditions.append(f"stat_name IN ({', '.join('?' for _ in query.stat_names)})")
+            params += query.stat_names
+        date_conditions, date_params = SqliteDataSource._date_conditions(query.date_range)
+        conditions += date_conditions
+        params += date_params
+        for predicate in query.predicates:
+            if predicate.value is None:
+                conditions.append("json_type(stat_data, ?) = 'null'")
+                params.append(json_path(predicate.path))
+            else:
+                # Checking the type too, as json_extract gives booleans as 1 and 0, which would equal numbers
+                json_types = "('text')" if isinstance(predicate.value, str) else "('integer', 'real')"
+                conditions.append(f"json_type(stat_data, ?) IN {json_types} AND json_extract(stat_data, ?) = ?")
+                params += [json_path(predicate.path), json_path(predicate.path), predicate.value]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"SELECT {', '.join(columns)} FROM dailys_data{where}", params
+
+    @staticmethod
+    def _compile(query: StatQuery) -> Tuple[str, List]:
+        sql, params = SqliteDataSource._select(query)
+        direction = "DESC" if query.descending else "ASC"
+        sql += f" ORDER BY stat_date {direction}, stat_name {direction}"
+        if query.limit is not None:
+            sql += " LIMIT ?"
+            params.append(query.limit)
+        return sql, params
+
+    def get_entries_for_query(self, query: StatQuery) -> DailysEntries:
+        return list(self.iter_entries_for_query(query))
+
+    def iter_entries_for_query(self, query: StatQuery) -> Iterator[DailysEntry]:
+        # SQLite cursors step through results lazily, so this only holds one row at a time
+        with self._connection(read_only=True) as conn:
+            for row in conn.execute(*self._compile(query)):
+                yield entry_from_query_row(row, query)
+
+    def get_entries_for_stats_over_range(
+            self,
+            stat_ranges: StatRanges,
+            include_static: Iterable[str] = ()
+    ) -> StatsEntries:
+        # Stats sharing a date range share a subquery, and static entries come back with a null date
+        selects = []
+        params = []
+        for query in queries_for_stat_ranges(stat_ranges):
+            select_sql, select_params = self._select(query)
+            selects.append(select_sql)
+            params += select_params
+        include_static = list(include_static)
+        if include_static:
+            selects.append(
+                "SELECT stat_name, NULL AS stat_date, source, stat_data FROM dailys_static "
+                f"WHERE stat_name IN ({', '.join('?' for _ in include_static)})"
+            )
+            params += include_static
+        if not selects:
+            return StatsEntries({}, {})
+        with self._connection(read_only=True) as conn:
+            rows = conn.execute(f"{' UNION ALL '.join(selects)} ORDER BY stat_date", params).fetchall()
+            entries = (
+                entry_from_static_row(row) if row["stat_date"] is None else entry_from_row(row)
+                for row in rows
+            )
+            return group_by_stat(entries, stat_ranges.keys())
+
+    def get_value_counts_over_range(self, start_date: DailysDate, end_date: DailysDate) -> List[ValueCount]:
+        conditions, params = self._date_conditions(DateRange.between(start_date, end_date))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        with self._connection(read_only=True) as conn:
+            rows = conn.execute(
+                f"SELECT stat_date, stat_name, source, \"values\" FROM dailys_value_counts {where}"
+                "ORDER BY stat_date, stat_name",
+                params
+            ).fetchall()
+            return [
+                ValueCount(row["stat_name"], date.fromisoformat(row["stat_date"]), row["source"], 1, row["values"])
+                for row in rows
+            ]
+
+    @staticmethod
+    def _value_count_row(stat_name: str, stat_date: str, source: str, data: DailysData) -> Tuple:
+        entry = {
+            "stat_name": stat_name,
+            "date": datetime.combine(date.fromisoformat(stat_date), time(0, 0, 0)),
+            "source": source,
+            "data": data
+        }
+        return stat_name, stat_date, source, stored_value_count(entry)
+
+    def _write_entries(self, conn: sqlite3.Connection, data_rows: List[Tuple], static_rows: List[Tuple]) -> None:
+        conn.executemany(
+            "INSERT INTO dailys_data (stat_name, stat_date, source, stat_data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (stat_name, stat_date) DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
+            [
+                (stat_name, stat_date, source, json.dumps(entry_data))
+                for (stat_name, stat_date, source, entry_data) in data_rows
+            ]
+        )
+        conn.executemany(
+            "INSERT INTO dailys_value_counts (stat_name, stat_date, source, \"values\") VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (stat_name, stat_date) DO UPDATE SET source=excluded.source, \"values\"=excluded.\"values\"",
+            [self._value_count_row(*row) for row in data_rows]
+        )
+        conn.executemany(
+            "INSERT INTO dailys_static (stat_name, source, stat_data) VALUES (?, ?, ?) "
+            "ON CONFLICT (stat_name) DO UPDATE SET source=excluded.source, stat_data=excluded.stat_data",
+            [(stat_name, source, json.dumps(entry_data)) for (stat_name, source, entry_data) in static_rows]
+        )
+        self._record_changes(
+            conn,
+            [(row[0], row[1]) for row in data_rows] + [(row[0], "static") for row in static_rows]
+        )
+
+    def rebuild_value_counts(self, progress: Optional[BulkProgressCallback] = None) -> int:
+        """Recalculates the whole value counts summary table from dailys_data, in one transaction"""
+        start_time = perf_counter()
+        total = 0
+        with self._connection() as conn:
+            conn.execute("DELETE FROM dailys_value_counts")
+            # Entries are read a batch at a time, rather than all held at once
+            rows = (
+                self._value_count_row(row["stat_name"], row["stat_date"], row["source"], json.loads(row["stat_data"]))
+                for row in conn.execute("SELECT stat_name, stat_date, source, stat_data FROM dailys_data")
+            )
+            for batch_number, batch in enumerate(batched(rows, self.itersize), start=1):
+                conn.executemany(
+                    "INSERT INTO dailys_value_counts (stat_name, stat_date, source, \"values\") VALUES (?, ?, ?, ?)",
+                    batch
+                )
+                total += len(batch)
+                if progress is not None:
+                    progress(BulkProgress(batch_number, len(batch), total, perf_counter() - start_time))
+        return total
+
+    def update_entry_for_stat_on_date(
+            self,
+            stat_name: str,
+            update_date: DailysDate,
+            new_data: DailysData,
+            source: str
+    ) -> DailysEntry:
+        if update_date in ["earliest", "latest"]:
+            raise ValueError("Can't update data on earliest/latest")
+        with self._connection() as conn:
+            if update_date == "static":
+                self._write_entries(conn, [], [(stat_name, source, new_data)])
+            else:
+                self._write_entries(conn, [(stat_name, row_date(update_date), source, new_data)], [])
+
+    def update_entries_bulk(
+            self,
+            entries: Iterable[DailysEntry],
+            batch_size: int = 1000,
+            progress: Optional[BulkProgressCallback] = None
+    ) -> int:
+        start_time = perf_counter()
+        total = 0
+        for batch_number, batch in enumerate(batched(entries, batch_size), start=1):
+            data_rows = []
+            static_rows = []
+            for entry in batch:
+                entry_date = entry["date"]
+                if entry_date in ["earliest", "latest"]:
+                    raise CantUpdate("Can't update data on earliest/latest")
+                if entry_date == "static":
+                    static_rows.append((entry["stat_name"], entry["source"], entry["data"]))
+                else:
+                    data_rows.append((entry["stat_name"], row_date(entry_date), entry["source"], entry["data"]))
+            with self._connection() as conn:
+                self._write_entries(conn, data_rows, static_rows)
+            total += len(batch)
+            if progress is not None:
+                progress(BulkProgress(batch_number, len(batch), total, perf_counter() - start_time))
+        return total
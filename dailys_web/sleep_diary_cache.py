@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from dailys_models.sleep_data import SleepData
+from dailys_web.lru_cache import LRUCache, CacheStats
+from dailys_web.sleep_diary_image import SleepDiaryImage, SleepDiarySvg
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever SleepDiaryImage draws differently, so that images rendered by older code aren't reused
+RENDER_VERSION = 1
+# The parts of a sleep entry's data which are drawn
+RENDERED_FIELDS = ["sleep_time", "wake_time", "interruptions"]
+# Image formats which can be rendered, and their mimetypes
+IMAGE_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+class SleepDiaryImageCache:
+    """
+    Caches rendered sleep diary images, as PNG or SVG data, in memory and optionally on disk, under a hash of
+    everything which is drawn: the sleep entry's date and times, the render parameters, and the format. Edited nights
+    hash differently, so only new or edited nights are ever rendered again, and nothing needs invalidating.
+    Images on disk are never cleaned up, as they're small, but the directory can be deleted at any time.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 4096,
+            directory: Optional[str] = None,
+            pix_per_hour: int = 20,
+            start_hour: int = 18
+    ) -> None:
+        self.memory = LRUCache(max_entries)
+        self.directory = directory
+        self.pix_per_hour = pix_per_hour
+        self.start_hour = start_hour
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "SleepDiaryImageCache":
+        return cls(
+            config.get("max_entries", 4096),
+            config.get("directory"),
+            config.get("pix_per_hour", 20),
+            config.get("start_hour", 18)
+        )
+
+    @property
+    def image_size(self) -> Tuple[int, int]:
+        return self.pix_per_hour * SleepDiaryImage.HOURS, SleepDiaryImage.img_height
+
+    def image_key(self, sleep_data: SleepData, image_format: str = "png") -> str:
+        data = sleep_data.raw_data["data"]
+        content = {
+            "render_version": RENDER_VERSION,
+            "format": image_format,
+            "pix_per_hour": self.pix_per_hour,
+            "start_hour": self.start_hour,
+            "date": sleep_data.date.date().isoformat(),
+            "data": {field: data.get(field) for field in RENDERED_FIELDS},
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def _disk_path(self, key: str, image_format: str) -> str:
+        # Spread across subdirectories, so that no one directory holds every night
+        return os.path.join(self.directory, key[:2], f"{key}.{image_format}")
+
+    def _read_disk(self, key: str, image_format: str) -> Optional[bytes]:
+        if self.directory is None:
+            return None
+        try:
+            with open(self._disk_path(key, image_format), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError:
+            # The disk store only saves rendering time, so images are rendered again rather than failing the page
+            logger.exception("Failed to read cached sleep diary image %s.%s", key, image_format)
+            return None
+
+    def _write_disk(self, key: str, image_format: str, image: bytes) -> None:
+        if self.directory is None:
+            return
+        path = self._disk_path(key, image_format)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file and rename it into place, so other workers never read half an image
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(image)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            # Disk errors, such as a full or read only disk, leave the image only cached in memory, rather than failing
+            # the page
+            logger.exception("Failed to write cached sleep diary image %s.%s", key, image_format)
+
+    def _render(self, sleep_data: SleepData, image_format: str) -> bytes:
+        if image_format == "svg":
+            svg = SleepDiarySvg(self.pix_per_hour, self.start_hour)
+            svg.add_sleep_data(sleep_data)
+            return svg.to_svg().encode()
+        image = SleepDiaryImage(self.pix_per_hour, self.start_hour)
+        image.add_sleep_data(sleep_data)
+        return image.to_png()
+
+    def get_image(self, sleep_data: SleepData, image_format: str = "png") -> bytes:
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown sleep diary image format: {image_format}")
+        key = self.image_key(sleep_data, image_format)
+        image = self.memory.get(key)
+        if image is not None:
+            return image
+        image = self._read_disk(key, image_format)
+        if image is None:
+            image = self._render(sleep_data, image_format)
+            self._write_disk(key, image_format, image)
+        self.memory.put(key, image)
+        return image
+
+    def get_png(self, sleep_data: SleepData) -> bytes:
+        return self.get_image(sleep_data, "png")
+
+    def get_svg(self, sleep_data: SleepData) -> str:
+        return self.get_image(sleep_data, "svg").decode()
+
+    def cache_stats(self) -> CacheStats:
+        return self.memory.stats()
@@ -1,14 +1,28 @@
 import base64
 import datetime
+from html import escape
 from io import BytesIO
+from typing import Dict, Tuple, List, Sequence, Optional
 
 import dateutil
 from PIL import Image, ImageDraw
 
 from dailys_models.sleep_data import SleepData
 
+Colour = Tuple[int, int, int]
+Point = Tuple[float, float]
 
-class SleepDiaryImage:
+# Rendered backgrounds, with the table, labels, and hour lines, which are the same for every night with the same
+# pix_per_hour and start_hour, keyed by those
+_BACKGROUNDS: Dict[Tuple[int, int], Image.Image] = {}
+_SVG_BACKGROUNDS: Dict[Tuple[int, int], List[str]] = {}
+
+
+class SleepDiary:
+    """
+    Lays out a sleep diary for one night: hour labels and lines along a table, with the periods spent asleep drawn
+    across it, and the total time asleep. Subclasses provide self.draw, with the ImageDraw methods used here.
+    """
     col_table_bg = (124, 124, 124)
     col_border = (50, 50, 50)
     col_data = (0, 0, 0)
@@ -24,9 +38,8 @@ class SleepDiaryImage:
         self.pix_per_hour = pix_per_hour
         self.start_hour = start_hour
         self.table_width = pix_per_hour * self.HOURS
-        self.im = Image.new("RGBA", (self.table_width, self.img_height))
 
-        self.draw = ImageDraw.Draw(self.im)
+    def _draw_background(self):
         self.draw.rectangle(
             [(0, self.box_top_y), (self.table_width, self.box_bottom_y)], self.col_table_bg, self.col_border, 1
         )
@@ -130,10 +143,104 @@ class SleepDiaryImage:
         text_width = self.draw.textlength(text)
         self.draw.text((self.table_width-text_width, self.box_bottom_y), text, self.col_text)
 
+
+class SleepDiaryImage(SleepDiary):
+
+    def __init__(self, pix_per_hour=20, start_hour=18):
+        super().__init__(pix_per_hour, start_hour)
+        # Start from a copy of the background, rather than measuring and drawing the labels and hours every time.
+        # Workers rendering the same background at once just draw it twice.
+        background = _BACKGROUNDS.get((pix_per_hour, start_hour))
+        if background is None:
+            background = _BACKGROUNDS[(pix_per_hour, start_hour)] = self._render_background()
+        self.im = background.copy()
+        self.draw = ImageDraw.Draw(self.im)
+
+    def _render_background(self) -> Image.Image:
+        self.im = Image.new("RGBA", (self.table_width, self.img_height))
+        self.draw = ImageDraw.Draw(self.im)
+        self._draw_background()
+        return self.im
+
     def save_to_file(self, filename):
         self.im.save(filename, "PNG")
 
-    def to_base64_encoded(self):
+    def to_png(self) -> bytes:
         buffered = BytesIO()
         self.im.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('ascii')
+        return buffered.getvalue()
+
+    def to_base64_encoded(self):
+        return base64.b64encode(self.to_png()).decode('ascii')
+
+
+class SvgDraw:
+    """
+    Records the subset of ImageDraw's methods used by SleepDiary as SVG elements. Text is measured with PIL's default
+    font, the same as SleepDiaryImage, so that both lay out identically.
+    """
+    _measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+    # Offset from the top of PIL's text to its baseline, where SVG positions text
+    _baseline = _measure.textbbox((0, 0), "0")[3]
+    font_size = getattr(_measure.getfont(), "size", 10)
+
+    def __init__(self, elements: Optional[List[str]] = None) -> None:
+        self.elements = elements or []
+
+    @staticmethod
+    def _num(value: float) -> str:
+        return f"{round(value, 2):g}"
+
+    @staticmethod
+    def _colour(colour: Colour) -> str:
+        return "#{:02x}{:02x}{:02x}".format(*colour)
+
+    def textlength(self, text: str) -> float:
+        return self._measure.textlength(text)
+
+    def text(self, xy: Point, text: str, fill: Colour) -> None:
+        x, y = xy
+        self.elements.append(
+            f'<text x="{self._num(x)}" y="{self._num(y + self._baseline)}" fill="{self._colour(fill)}">'
+            f'{escape(text)}</text>'
+        )
+
+    def line(self, points: Sequence[Point], fill: Colour, width: int = 1) -> None:
+        (x1, y1), (x2, y2) = points
+        self.elements.append(
+            f'<line x1="{self._num(x1)}" y1="{self._num(y1)}" x2="{self._num(x2)}" y2="{self._num(y2)}" '
+            f'stroke="{self._colour(fill)}" stroke-width="{width}"/>'
+        )
+
+    def rectangle(self, box: Sequence[Point], fill: Colour, outline: Colour, width: int = 1) -> None:
+        (x1, y1), (x2, y2) = box
+        self.elements.append(
+            f'<rect x="{self._num(x1)}" y="{self._num(y1)}" '
+            f'width="{self._num(x2 - x1)}" height="{self._num(y2 - y1)}" '
+            f'fill="{self._colour(fill)}" stroke="{self._colour(outline)}" stroke-width="{width}"/>'
+        )
+
+
+class SleepDiarySvg(SleepDiary):
+    """
+    Draws the same sleep diary as SleepDiaryImage, as SVG markup, which needs no rasterising or compressing, and
+    stays sharp at any scale.
+    """
+
+    def __init__(self, pix_per_hour=20, start_hour=18):
+        super().__init__(pix_per_hour, start_hour)
+        background = _SVG_BACKGROUNDS.get((pix_per_hour, start_hour))
+        if background is None:
+            self.draw = SvgDraw()
+            self._draw_background()
+            background = _SVG_BACKGROUNDS[(pix_per_hour, start_hour)] = self.draw.elements
+        self.draw = SvgDraw(list(background))
+
+    def to_svg(self) -> str:
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.table_width}" height="{self.img_height}" '
+            f'viewBox="0 0 {self.table_width} {self.img_height}" font-family="sans-serif" '
+            f'font-size="{SvgDraw.font_size}">'
+            + "".join(self.draw.elements)
+            + "</svg>"
+        )
@@ -0,0 +1,48 @@
+from typing import Iterable, Iterator
+
+import flask
+from flask import request
+
+from dailys_web.data_source.data_source import DailysEntry, batched
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Entries are encoded one at a time, but written out in batches, to avoid lots of tiny writes to the socket
+STREAM_BATCH_SIZE = 100
+
+
+def wants_ndjson() -> bool:
+    """Checks whether the client prefers newline delimited JSON over a JSON array"""
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def _encode(entry: DailysEntry) -> str:
+    # Use the app's JSON provider, so entries are encoded the same as by flask.jsonify()
+    return flask.json.dumps(entry, separators=(",", ":"))
+
+
+def _json_array_chunks(entries: Iterable[DailysEntry]) -> Iterator[str]:
+    yield "["
+    separator = ""
+    for batch in batched(entries, STREAM_BATCH_SIZE):
+        yield separator + ",".join(_encode(entry) for entry in batch)
+        separator = ","
+    yield "]"
+
+
+def _ndjson_chunks(entries: Iterable[DailysEntry]) -> Iterator[str]:
+    for batch in batched(entries, STREAM_BATCH_SIZE):
+        yield "".join(_encode(entry) + "\n" for entry in batch)
+
+
+def stream_entries(entries: Iterable[DailysEntry]) -> flask.Response:
+    """
+    Streams entries to the client as they are read, as a JSON array, or as newline delimited JSON if the client
+    accepts application/x-ndjson, so that the whole response is never held in memory.
+    """
+    if wants_ndjson():
+        chunks = _ndjson_chunks(entries)
+        mimetype = NDJSON_MIMETYPE
+    else:
+        chunks = _json_array_chunks(entries)
+        mimetype = "application/json"
+    return flask.Response(flask.stream_with_context(chunks), mimetype=mimetype)
@@ -0,0 +1,14 @@
+"""
+Backfills the Firestore change feed with every existing entry, for data written before the feed was kept.
+Run from the repository root: python -m importers.build_firestore_change_feed
+"""
+import json
+
+from dailys_web.data_source.firestore import FirestoreDataSource
+
+if __name__ == "__main__":
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    data_source = FirestoreDataSource(config["database"].get("page_size", 500))
+    total = data_source.build_change_feed(progress=print)
+    print(f"Added {total} entries to the change feed")
@@ -18,6 +18,7 @@ if __name__ == "__main__":
     start_date = datetime.datetime(2016, 4, 11)
     end_date = datetime.datetime(2020, 10, 25)
     sleep_data_resp = data_source.get_entries_for_stat_over_range("sleep", start_date, end_date)
+    fixed_entries = []
     for sleep_stat in sleep_data_resp:
         sleep_datum = sleep_stat["data"]
         print(sleep_stat)
@@ -29,4 +30,5 @@ if __name__ == "__main__":
             if "wake_time" in i:
                 i['wake_time'] = add_tz_if_missing(i['wake_time'])
         print(sleep_stat)
-        data_source.update_entry_for_stat_on_date("sleep", sleep_stat["date"], sleep_datum, sleep_stat["source"])
+        fixed_entries.append(sleep_stat)
+    data_source.update_entries_bulk(fixed_entries, progress=print)
@@ -14,6 +14,7 @@ with open("import_dreams_data.txt", "r") as f:
 
 data_source = DataSource()
 
+entries = []
 entry_date = start_date - timedelta(days=1)
 for line in spreadsheet_data:
     entry_date = entry_date + timedelta(days=1)
@@ -46,10 +47,12 @@ for line in spreadsheet_data:
             dream_data["disorientation"] = int(cells[3])
         if cells[4] not in ["not in use", "none"]:
             dream_data["lewdness"] = int(cells[4])
-    data_source.update_entry_for_stat_on_date(
-        stat_name,
-        entry_date,
-        dream_data,
-        source
-    )
+    entries.append({
+        "stat_name": stat_name,
+        "date": entry_date,
+        "source": source,
+        "data": dream_data
+    })
     print(json.dumps(dream_data, indent=2))
+
+data_source.update_entries_bulk(entries, progress=print)
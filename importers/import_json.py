@@ -23,7 +23,7 @@ def read_json_list(file_name):
 
 
 def upload_data(post_url, post_data):
-    response = requests.put\
+    response = requests.post\
         (
             url=post_url,
             json=post_data,
@@ -35,9 +35,14 @@ def upload_data(post_url, post_data):
 if __name__ == "__main__":
     data = read_json_list("raw_data.txt")
     date = START_DATE
+    records = []
     for datum in data:
         if datum is not None:
-            url = "{}/stats/{}/{}?source={}".format(BASE_URL, STAT_NAME, date, SOURCE)
-            resp = upload_data(url, datum)
-            print(resp)
+            records.append({"stat_name": STAT_NAME, "date": date.isoformat(), "source": SOURCE, "data": datum})
         date += timedelta(days=1)
+    url = "{}/stats/_bulk".format(BASE_URL)
+    resp = upload_data(url, records)
+    print(resp)
+    for result in resp.json()["results"]:
+        if result["status"] != "ok":
+            print(result)
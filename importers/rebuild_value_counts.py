@@ -0,0 +1,14 @@
+"""
+Backfills the dailys_value_counts summary table from the existing data, for the postgres and sqlite data sources.
+Run from the repository root: python -m importers.rebuild_value_counts
+"""
+import json
+
+from dailys_web.data_source.loader import load_data_source
+
+if __name__ == "__main__":
+    with open("config.json", "r") as f:
+        config = json.load(f)
+    data_source = load_data_source(config["database"])
+    total = data_source.rebuild_value_counts(progress=print)
+    print(f"Rebuilt value counts for {total} entries")
@@ -5,7 +5,9 @@ import flask
 from dailys_web.blueprints.forms import FormsBlueprint
 from dailys_web.blueprints.stats import StatsBlueprint
 from dailys_web.blueprints.views.blueprint import ViewsBlueprint
-from dailys_web.data_source.postgres import PostgresDataSource
+from dailys_web.compression import ResponseCompressor
+from dailys_web.data_source.caching import CachingDataSource
+from dailys_web.data_source.loader import load_data_source
 from dailys_web.decorators import view_auth_required, get_auth_key
 from dailys_web.path_converters import DateConverter, EndDateConverter, SpecifiedDayConverter, StartDateConverter
 
@@ -19,6 +21,9 @@ app.url_map.converters['view_date'] = SpecifiedDayConverter
 with open("config.json", "r") as f:
     CONFIG = json.load(f)
 
+if "compression" in CONFIG:
+    ResponseCompressor(CONFIG["compression"]).register(app)
+
 
 @app.route("/")
 def hello_world():
@@ -39,7 +44,16 @@ def login_submit():
     return resp
 
 
-data_source = PostgresDataSource(CONFIG["database"])
+database = load_data_source(CONFIG["database"])
+data_source = database
+if "cache" in CONFIG:
+    data_source = CachingDataSource(database, CONFIG["cache"].get("max_entries", 256))
+    # Other workers' writes need to invalidate this worker's cache too, for backends which can share a database
+    if hasattr(database, "listen_for_changes"):
+        database.listen_for_changes(
+            lambda stat_name, _: data_source.invalidate_stat(stat_name),
+            data_source.invalidate_all
+        )
 stats_blueprint = StatsBlueprint(data_source)
 stats_blueprint.register()
 app.register_blueprint(stats_blueprint.blueprint, url_prefix="/stats")
@@ -50,3 +64,18 @@ forms_blueprint = FormsBlueprint(data_source, CONFIG)
 forms_blueprint.register()
 app.register_blueprint(forms_blueprint.blueprint, url_prefix="/forms")
 
+
+@app.route("/pool_stats.json")
+@view_auth_required
+def pool_stats():
+    if not hasattr(database, "pool_stats"):
+        flask.abort(404)
+    return flask.jsonify(database.pool_stats()._asdict())
+
+
+@app.route("/cache_stats.json")
+@view_auth_required
+def cache_stats():
+    if not isinstance(data_source, CachingDataSource):
+        flask.abort(404)
+    return flask.jsonify(data_source.cache_stats()._asdict())
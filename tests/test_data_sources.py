@@ -0,0 +1,124 @@
+"""
+Runs the same cases against each data source which needs no server, so that their behaviour can't drift apart.
+Run from the repository root: python -m pytest tests
+"""
+from datetime import datetime, date
+
+import pytest
+
+from dailys_web.data_source.data_source import StatQuery, DateRange, JsonPredicate
+from dailys_web.data_source.in_memory import InMemoryDataSource
+from dailys_web.data_source.sqlite import SqliteDataSource
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def data_source(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryDataSource()
+    return SqliteDataSource({"path": str(tmp_path / "dailys.sqlite3")})
+
+
+def day(n: int) -> datetime:
+    return datetime(2020, 1, n)
+
+
+def dates_and_stats(entries):
+    return [(entry["date"], entry["stat_name"]) for entry in entries]
+
+
+def test_query_orders_filters_and_limits(data_source):
+    for n in range(1, 6):
+        data_source.update_entry_for_stat_on_date("a", day(n), {"n": n}, "test")
+    for n in [2, 4]:
+        data_source.update_entry_for_stat_on_date("b", day(n), {"n": n}, "test")
+    data_source.update_entry_for_stat_on_date("a", "static", {"static": True}, "test")
+    query = StatQuery(("a", "b"), DateRange(date(2020, 1, 2), date(2020, 1, 4)))
+
+    entries = data_source.get_entries_for_query(query)
+    latest = data_source.get_entries_for_query(query._replace(descending=True, limit=2))
+
+    assert dates_and_stats(entries) == [(day(2), "a"), (day(2), "b"), (day(3), "a"), (day(4), "a"), (day(4), "b")]
+    assert dates_and_stats(latest) == [(day(4), "b"), (day(4), "a")]
+    assert [entry["date"] for entry in data_source.get_entries_for_stat("a")][-1] == "static"
+
+
+def test_pages_follow_on(data_source):
+    for n in range(1, 6):
+        data_source.update_entry_for_stat_on_date("a", day(n), {"n": n, "other": 0}, "test")
+
+    pages = []
+    after = None
+    while True:
+        page = data_source.get_page_for_stat_over_range("a", "earliest", "latest", 2, after, fields=["n"])
+        pages.append([entry["data"] for entry in page.entries])
+        after = page.next_after
+        if after is None:
+            break
+
+    assert pages == [[{"n": 1}, {"n": 2}], [{"n": 3}, {"n": 4}], [{"n": 5}]]
+
+
+def test_fields_project_nested_data(data_source):
+    data = {"x": 1, "nested": {"y": 2, "z": 3}, "list": [1, 2], "with space": None}
+    data_source.update_entry_for_stat_on_date("a", day(1), data, "test")
+
+    entries = data_source.get_entries_for_stat_on_date("a", day(1), ["nested.y", "list", "with space", "missing"])
+
+    assert entries[0]["data"] == {"nested": {"y": 2}, "list": [1, 2], "with space": None}
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1, [1, 1.0]),
+    (1.0, [1, 1.0]),
+    ("1", ["1"]),
+    (None, [None]),
+])
+def test_predicates_compare_as_json(data_source, value, expected):
+    for n, stored in enumerate([True, 1, 1.0, "1", None, [1], {"a": 1}], start=1):
+        data_source.update_entry_for_stat_on_date("a", day(n), {"value": stored}, "test")
+    data_source.update_entry_for_stat_on_date("a", day(20), {}, "test")
+
+    entries = data_source.get_entries_for_query(StatQuery.for_stat("a", predicates=(JsonPredicate(("value",), value),)))
+
+    assert [entry["data"]["value"] for entry in entries] == expected
+
+
+@pytest.mark.parametrize("value", [True, [1], {"a": 1}])
+def test_predicates_reject_unsupported_values(value):
+    with pytest.raises(TypeError):
+        JsonPredicate(("value",), value)
+
+
+def test_change_feed_lists_latest_change_of_each_entry(data_source):
+    data_source.update_entry_for_stat_on_date("a", day(1), {"n": 1}, "test")
+    data_source.update_entry_for_stat_on_date("a", day(2), {"n": 2}, "test")
+    first = data_source.get_changes_since(0, 10)
+    data_source.update_entry_for_stat_on_date("a", day(1), {"n": 3}, "test")
+    data_source.remove_stat_on_date("a", day(2))
+
+    changes = data_source.get_changes_since(first[-1].seq, 10)
+
+    assert [(change.date, change.entry and change.entry["data"]) for change in changes] == [
+        (day(1), {"n": 3}),
+        (day(2), None)
+    ]
+    assert changes[0].seq < changes[1].seq
+    assert data_source.get_changes_since(0, 1) == changes[:1]
+
+
+def test_changing_returned_entries_leaves_store_unchanged(data_source):
+    data = {"chores_done": ["a"]}
+    data_source.update_entry_for_stat_on_date("chores", day(1), data, "test")
+    data["chores_done"].append("b")
+
+    data_source.get_entries_for_stat_on_date("chores", day(1))[0]["data"]["chores_done"].append("c")
+
+    assert data_source.get_entries_for_stat_on_date("chores", day(1))[0]["data"] == {"chores_done": ["a"]}
+
+
+def test_malformed_entries_count_no_values(data_source):
+    data_source.update_entry_for_stat_on_date("dreams", day(1), {"not_dreams": 1}, "test")
+
+    counts = data_source.get_value_counts_over_range("earliest", "latest")
+
+    assert [(count.stat_name, count.entries, count.values) for count in counts] == [("dreams", 1, 0)]